@@ -0,0 +1,7 @@
+from utils.analysis import run_analysis
+from utils.common import parse_analysis_args
+
+
+if __name__ == "__main__":
+    args = parse_analysis_args()
+    run_analysis(args.result_store, args.permutation_design)
@@ -0,0 +1,359 @@
+import argparse
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from email.parser import BytesParser
+from email.policy import default
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def parse_latency(spec):
+    # constant:0.2 | uniform:0.1,0.5 | exponential:0.3 | lognormal:-1.5,0.5 (seconds)
+    name, _, params = spec.partition(":")
+    params = [float(param) for param in params.split(",") if param]
+    if name == "constant":
+        return lambda: params[0]
+    elif name == "uniform":
+        return lambda: random.uniform(params[0], params[1])
+    elif name == "exponential":
+        return lambda: random.expovariate(1 / params[0])
+    elif name == "lognormal":
+        return lambda: random.lognormvariate(params[0], params[1])
+    else:
+        raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+class MockLLMServer(ThreadingHTTPServer):
+    """Stand-in for the OpenAI and Azure serverless /v1/chat/completions and /v1/completions endpoints, and for the
+    OpenAI /v1/files and /v1/batches endpoints of the Batch API."""
+
+    daemon_threads = True
+
+    def __init__(self, address, latency="constant:0.2", rate_limit_rate=0.0, server_error_rate=0.0,
+                 answer="random", filler_words=0, retry_after=1, trailing_words=0, token_latency=0.0):
+        super().__init__(address, MockLLMHandler)
+        self.sample_latency = parse_latency(latency)
+        self.rate_limit_rate = rate_limit_rate
+        self.server_error_rate = server_error_rate
+        self.answer = answer
+        self.filler_words = filler_words
+        self.retry_after = retry_after
+        self.trailing_words = trailing_words
+        self.token_latency = token_latency
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "rate_limited": 0, "server_errors": 0, "completed": 0, "streams_cancelled": 0, "batches": 0}
+        self.files = dict()
+        self.batches = dict()
+
+    def count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    @staticmethod
+    def get_symbols(prompt):
+        return [symbol for symbol in "ABCDEFG" if f"[The start of choice {symbol}]" in prompt] or ["A"]
+
+    def get_answer(self, prompt, max_tokens=None):
+        if self.answer == "random":
+            # Pick one of the choice symbols that appear in the prompt
+            symbol = random.choice(self.get_symbols(prompt))
+        else:
+            symbol = self.answer
+        # A request for at most a few tokens is a symbol_only prompt, answered with the bare symbol
+        if max_tokens is not None and max_tokens <= 3:
+            return symbol
+        filler = " ".join(["because"] * self.filler_words)
+        trailing = " ".join(["explanation"] * self.trailing_words)
+
+        return f"{filler} My final verdict is [[{symbol}]]. {trailing}".strip()
+
+    def get_logprobs(self, prompt, answer):
+        # Chat logprobs of a bare symbol answer, most of the mass on the answer and the rest spread over the other symbols
+        symbols = self.get_symbols(prompt)
+        top_logprobs = [
+            {"token": symbol, "logprob": math.log(0.7 if symbol == answer else 0.3 / max(len(symbols) - 1, 1)), "bytes": None}
+            for symbol in symbols
+        ]
+
+        return {"content": [{"token": answer, "logprob": math.log(0.7), "bytes": None, "top_logprobs": top_logprobs}]}
+
+    def get_completion(self, path, request):
+        if path.endswith("/chat/completions"):
+            prompt = request["messages"][-1]["content"]
+            choices = []
+            for i in range(request.get("n", 1)):
+                answer = self.get_answer(prompt, request.get("max_tokens"))
+                logprobs = self.get_logprobs(prompt, answer) if request.get("logprobs") and len(answer) == 1 else None
+                choices.append({
+                    "index": i,
+                    "message": {"role": "assistant", "content": answer},
+                    "finish_reason": "stop",
+                    "logprobs": logprobs,
+                })
+            response_object = "chat.completion"
+        elif path.endswith("/completions"):
+            prompt = request["prompt"]
+            choices = [
+                {"index": i, "text": self.get_answer(prompt, request.get("max_tokens")), "finish_reason": "stop", "logprobs": None}
+                for i in range(request.get("n", 1))
+            ]
+            response_object = "text_completion"
+        else:
+            return None
+
+        completion_tokens = sum(len(choice.get("text") or choice["message"]["content"]) // 4 for choice in choices)
+        prompt_tokens = len(prompt) // 4
+        return {
+            "id": f"mock-{uuid.uuid4().hex}",
+            "object": response_object,
+            "created": int(time.time()),
+            "model": request.get("model", "mock"),
+            "system_fingerprint": "mock",
+            "choices": choices,
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+    def add_file(self, content):
+        file_id = f"file-{uuid.uuid4().hex}"
+        with self.lock:
+            self.files[file_id] = content
+
+        return file_id
+
+    def create_batch(self, request):
+        # The batch stays in_progress for one latency sample, then every request line is answered at once.
+        # server_error_rate applies per line, as a failed response in the output file
+        batch = {
+            "id": f"batch_{uuid.uuid4().hex}",
+            "object": "batch",
+            "endpoint": request["endpoint"],
+            "completion_window": request.get("completion_window", "24h"),
+            "input_file_id": request["input_file_id"],
+            "status": "in_progress",
+            "created_at": int(time.time()),
+            "output_file_id": None,
+            "error_file_id": None,
+            "errors": None,
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+        }
+        with self.lock:
+            self.batches[batch["id"]] = batch
+            self.stats["batches"] += 1
+        threading.Thread(target=self.run_batch, args=(batch,), daemon=True).start()
+
+        return dict(batch)
+
+    def run_batch(self, batch):
+        time.sleep(self.sample_latency())
+        lines = []
+        num_failed = 0
+        for line in self.files[batch["input_file_id"]].decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            if random.random() < self.server_error_rate:
+                num_failed += 1
+                status, body = 500, {"error": {"message": "Internal server error", "type": "server_error", "code": None}}
+            else:
+                status, body = 200, self.get_completion(request["url"], request["body"])
+            lines.append(json.dumps({
+                "id": f"batch_req_{uuid.uuid4().hex}",
+                "custom_id": request["custom_id"],
+                "response": {"status_code": status, "request_id": uuid.uuid4().hex, "body": body},
+                "error": None,
+            }))
+
+        output_file_id = self.add_file("\n".join(lines).encode("utf-8"))
+        with self.lock:
+            batch.update({
+                "status": "completed",
+                "output_file_id": output_file_id,
+                "request_counts": {"total": len(lines), "completed": len(lines) - num_failed, "failed": num_failed},
+            })
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+
+        return thread
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body, headers=None):
+        content = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def send_stream(self, request, completion_id, answer):
+        # Server-sent events of an OpenAI-style chat stream, one word per chunk
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+
+        def chunk(delta, finish_reason=None, usage=None):
+            return {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": request.get("model", "mock"),
+                "system_fingerprint": "mock",
+                "choices": [] if usage else [{"index": 0, "delta": delta, "finish_reason": finish_reason, "logprobs": None}],
+                "usage": usage,
+            }
+
+        words = answer.split(" ")
+        events = [chunk({"role": "assistant", "content": ""})]
+        events += [chunk({"content": word if i == 0 else f" {word}"}) for i, word in enumerate(words)]
+        events.append(chunk({}, "stop"))
+        if (request.get("stream_options") or {}).get("include_usage"):
+            prompt_tokens = len(request["messages"][-1]["content"]) // 4
+            events.append(chunk({}, usage={
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": len(words),
+                "total_tokens": prompt_tokens + len(words),
+            }))
+
+        try:
+            for event in events:
+                self.wfile.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+                time.sleep(self.server.token_latency)
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # The client closed the stream early
+            self.server.count("streams_cancelled")
+            return
+        self.server.count("completed")
+
+    def do_POST(self):
+        server = self.server
+        # The Batch API endpoints are not subject to the injected latency and failures
+        if self.path.endswith("/files"):
+            return self.create_file()
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if self.path.endswith("/batches"):
+            return self.send_json(200, server.create_batch(request))
+
+        server.count("requests")
+        time.sleep(server.sample_latency())
+
+        roll = random.random()
+        if roll < server.rate_limit_rate:
+            server.count("rate_limited")
+            # Azure puts the message at the top level, OpenAI under "error"
+            return self.send_json(429, {
+                "message": "Rate Limit exceeded, please retry later",
+                "error": {"message": "Rate limit exceeded", "type": "rate_limit_error", "code": "rate_limit_exceeded"},
+            }, {"Retry-After": str(server.retry_after)})
+        elif roll < server.rate_limit_rate + server.server_error_rate:
+            server.count("server_errors")
+            return self.send_json(500, {
+                "message": "Internal server error",
+                "error": {"message": "Internal server error", "type": "server_error", "code": None},
+            })
+
+        if self.path.endswith("/chat/completions") and request.get("stream"):
+            prompt = request["messages"][-1]["content"]
+            return self.send_stream(request, f"mock-{uuid.uuid4().hex}", server.get_answer(prompt, request.get("max_tokens")))
+
+        completion = server.get_completion(self.path, request)
+        if completion is None:
+            return self.send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+        # A non-streamed answer arrives once all of it is generated
+        answer = completion["choices"][0].get("text") or completion["choices"][0]["message"]["content"]
+        time.sleep(server.token_latency * len(answer.split(" ")))
+
+        server.count("completed")
+        self.send_json(200, completion)
+
+    def do_GET(self):
+        server = self.server
+        parts = self.path.strip("/").split("/")
+        # /v1/batches/{id} and /v1/files/{id}/content
+        if parts[-2:-1] == ["batches"] and parts[-1] in server.batches:
+            with server.lock:
+                return self.send_json(200, dict(server.batches[parts[-1]]))
+        elif parts[-1] == "content" and parts[-2] in server.files:
+            content = server.files[parts[-2]]
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+        else:
+            self.send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def create_file(self):
+        # The SDK uploads the batch input as multipart/form-data with "file" and "purpose" fields
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        message = BytesParser(policy=default).parsebytes(
+            f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode("utf-8") + body
+        )
+        fields = {part.get_param("name", header="content-disposition"): part for part in message.iter_parts()}
+        content = fields["file"].get_payload(decode=True)
+
+        file_id = self.server.add_file(content)
+        self.send_json(200, {
+            "id": file_id,
+            "object": "file",
+            "bytes": len(content),
+            "created_at": int(time.time()),
+            "filename": fields["file"].get_filename() or "input.jsonl",
+            "purpose": fields["purpose"].get_content().strip() if "purpose" in fields else "batch",
+            "status": "processed",
+        })
+
+
+def parse_server_args(parser=None):
+    parser = parser or argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1", type=str)
+    parser.add_argument("--port", default=8765, type=int)
+    parser.add_argument("--latency", default="constant:0.2", type=str,
+                        help="constant:S, uniform:LOW,HIGH, exponential:MEAN or lognormal:MU,SIGMA in seconds")
+    parser.add_argument("--rate_limit_rate", default=0.0, type=float, help="fraction of requests answered with 429")
+    parser.add_argument("--server_error_rate", default=0.0, type=float, help="fraction of requests answered with 500")
+    parser.add_argument("--answer", default="random", type=str, help="symbol put in [[X]], or random")
+    parser.add_argument("--filler_words", default=0, type=int, help="words of explanation before the verdict")
+    parser.add_argument("--retry_after", default=1, type=int, help="Retry-After header sent with 429 responses")
+    parser.add_argument("--trailing_words", default=0, type=int, help="words of explanation after the verdict")
+    parser.add_argument("--token_latency", default=0.0, type=float, help="seconds between streamed chunks")
+
+    return parser
+
+
+def create_server(args):
+    return MockLLMServer(
+        (args.host, args.port),
+        latency=args.latency,
+        rate_limit_rate=args.rate_limit_rate,
+        server_error_rate=args.server_error_rate,
+        answer=args.answer,
+        filler_words=args.filler_words,
+        retry_after=args.retry_after,
+        trailing_words=args.trailing_words,
+        token_latency=args.token_latency,
+    )
+
+
+if __name__ == "__main__":
+    args = parse_server_args().parse_args()
+    server = create_server(args)
+    print(f"Mock LLM server listening on http://{args.host}:{args.port}")
+    server.serve_forever()
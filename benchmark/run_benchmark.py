@@ -0,0 +1,130 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append(os.path.dirname(__file__))
+from mock_server import parse_server_args, create_server
+
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+
+def histogram_quantile(histograms, quantile):
+    # Merge the histograms and interpolate inside the bucket holding the quantile, like Prometheus does
+    buckets = dict()
+    for histogram in histograms:
+        for bound, count in histogram["buckets"].items():
+            buckets[float(bound)] = buckets.get(float(bound), 0) + count
+    bounds = sorted(buckets)
+    if not bounds or buckets[bounds[-1]] == 0:
+        return None
+
+    rank = quantile * buckets[bounds[-1]]
+    lower_bound, lower_count = 0.0, 0
+    for bound in bounds:
+        if buckets[bound] >= rank:
+            if bound == float("inf"):
+                return lower_bound
+            return lower_bound + (bound - lower_bound) * (rank - lower_count) / max(buckets[bound] - lower_count, 1)
+        lower_bound, lower_count = bound, buckets[bound]
+
+
+def get_counter(metrics, name, **labels):
+    return sum(
+        counter["value"]
+        for counter in metrics["counters"]
+        if counter["name"] == name and all(counter["labels"].get(key) == value for key, value in labels.items())
+    )
+
+
+def get_histograms(metrics, name, **labels):
+    return [
+        histogram
+        for histogram in metrics["histograms"]
+        if histogram["name"] == name and all(histogram["labels"].get(key) == value for key, value in labels.items())
+    ]
+
+
+def run_benchmark(args, main_args):
+    server = create_server(args)
+    server.start()
+    base_url = f"http://{args.host}:{server.server_address[1]}"
+
+    work_dir = Path(args.work_dir or tempfile.mkdtemp(prefix="llm_benchmark_"))
+    work_dir.mkdir(exist_ok=True, parents=True)
+    metrics_path = work_dir / "metrics.json"
+    env = {
+        **os.environ,
+        "OPENAI_BASE_URL": f"{base_url}/v1",
+        "OPENAI_API_KEY_NLG": "mock-openai-key",
+        "AZURE_ENDPOINT_BASE_URL": base_url,
+        "AZURE_LLAMA_7B_CHAT": "mock-azure-key",
+        "AZURE_LLAMA_13B_CHAT": "mock-azure-key",
+        "AZURE_LLAMA_70B_CHAT": "mock-azure-key",
+        "LLM_CACHE_PATH": str(work_dir / "llm_cache.sqlite"),
+        "LLM_KEY_COOLDOWN": str(args.retry_after),
+    }
+    command = [
+        sys.executable, str(REPO_DIR / "main.py"),
+        "--tasks", args.tasks,
+        "--model", *args.model,
+        "--no_cache",
+        "--metrics_file", str(metrics_path),
+        *main_args,
+    ]
+
+    # main.py runs in the work directory, so results/ and artifacts/ of the benchmark stay out of the repository
+    start = time.perf_counter()
+    with (work_dir / "main.log").open("w") as log:
+        subprocess.run(command, cwd=work_dir, env=env, stdout=log, stderr=subprocess.STDOUT, check=True)
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+
+    metrics = json.loads(metrics_path.read_text())
+    jobs = get_counter(metrics, "jobs_completed_total")
+    requests = get_histograms(metrics, "llm_request_seconds")
+    writes = get_histograms(metrics, "stage_seconds", stage="result_write")
+    write_seconds = sum(histogram["sum"] for histogram in writes)
+    num_writes = sum(histogram["count"] for histogram in writes)
+    retry_sleep = get_counter(metrics, "llm_retry_sleep_seconds_total")
+    request_seconds = sum(histogram["sum"] for histogram in requests)
+
+    report = {
+        "wall_clock_seconds": round(elapsed, 3),
+        "jobs_completed": int(jobs),
+        "jobs_per_second": round(jobs / elapsed, 3),
+        "request_latency_p50": histogram_quantile(requests, 0.5),
+        "request_latency_p99": histogram_quantile(requests, 0.99),
+        "retries": int(get_counter(metrics, "llm_retries_total")),
+        "rate_limited": int(get_counter(metrics, "llm_rate_limited_total")),
+        "retry_sleep_seconds": round(retry_sleep, 3),
+        # Share of worker time spent sleeping between retries rather than waiting on requests
+        "retry_overhead": round(retry_sleep / (retry_sleep + request_seconds), 3) if retry_sleep + request_seconds else 0,
+        "result_writes_per_second": round(num_writes / write_seconds, 1) if write_seconds else None,
+        "server": server.stats,
+        "work_dir": str(work_dir),
+    }
+    print(json.dumps(report, indent=4))
+    (work_dir / "report.json").write_text(json.dumps(report, indent=4))
+
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run main.py against a local mock LLM server, any unknown arguments are passed on to main.py"
+    )
+    parse_server_args(parser)
+    # Let the OS pick a free port unless one is asked for
+    parser.set_defaults(port=0)
+    parser.add_argument("--tasks", default="mmlu_abstract_algebra", type=str)
+    parser.add_argument("--model", default=["gpt-3.5-1106"], type=str, nargs="+")
+    parser.add_argument("--work_dir", default=None, type=str)
+    args, main_args = parser.parse_known_args()
+
+    run_benchmark(args, main_args)
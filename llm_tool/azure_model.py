@@ -0,0 +1,174 @@
+import json
+import time
+
+import requests
+
+from .model import LLMModel
+from .utils import retry_with_exponential_backoff, register_retryable_errors, get_retry_after, \
+    AzureRateLimitError, AzureServerError
+from .concurrency import get_limiter, get_concurrency_limit
+from .hedging import get_latency_tracker, run_hedged
+from .streaming import StreamedCompletion, iter_sse_chunks, read_chat_stream
+from .metrics import METRICS, mask_api_key
+from .config import AZURE_API_KEY, get_azure_endpoint
+
+
+register_retryable_errors(
+    AzureRateLimitError, AzureServerError, requests.exceptions.Timeout, requests.exceptions.ConnectionError,
+)
+
+
+class LlamaModel(LLMModel):
+    provider = "azure"
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.url = get_azure_endpoint(self.model_display_name)
+        self.api_key = AZURE_API_KEY[self.model_display_name]
+        self.headers = {'Content-Type':'application/json', 'Authorization':('Bearer '+ self.api_key)}
+
+        pool_size = get_concurrency_limit(self.provider)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update(self.headers)
+
+    @retry_with_exponential_backoff
+    def generate_base(self, **kwargs):
+        data =  {
+            "prompt": kwargs.get("prompt", "How are you?"),
+            "temperature": kwargs.get("temperature", 0),
+            "max_tokens": kwargs.get("max_output_tokens", 1024),
+            "n": kwargs.get("candidate_count", 1),
+            "logprobs": kwargs.get("logprobs", 5)
+        }
+        if kwargs.get("stop_sequences"):
+            data["stop"] = kwargs["stop_sequences"]
+
+        re = self.post(data, kwargs.get("hedge_quantile"))
+        kwargs["completion"] = json.loads(re.text)
+
+        return self.process_result(**kwargs)
+
+    @retry_with_exponential_backoff
+    def generate_chat(self, **kwargs):
+        data =  {
+            "messages": [
+                {
+                "role": "user",
+                "content": kwargs.get("prompt", "How are you?"),
+                }
+            ],
+            "temperature": kwargs.get("temperature", 0),
+            "max_tokens": kwargs.get("max_output_tokens", 1024),
+            "n": kwargs.get("candidate_count", 1),
+            "logprobs": kwargs.get("logprobs", 5) # not supported yet
+        }
+        if kwargs.get("stop_sequences"):
+            data["stop"] = kwargs["stop_sequences"]
+        if self.should_stream(**kwargs):
+            data["stream"] = True
+
+        re = self.post(data, kwargs.get("hedge_quantile"), kwargs.get("stop_sequences"))
+        kwargs["completion"] = getattr(re, "streamed_completion", None) or json.loads(re.text)
+
+        if re.status_code == 429 and kwargs["completion"]["message"].startswith("Rate Limit"):
+            METRICS.inc("llm_rate_limited_total", provider=self.provider, key=mask_api_key(self.api_key))
+            raise AzureRateLimitError(retry_after=re.headers.get("Retry-After"))
+        elif re.status_code == 500:
+            raise AzureServerError
+
+        return self.process_result(**kwargs)
+
+    def post(self, data, hedge_quantile=None, stop_sequences=None):
+        delay = get_latency_tracker(self.provider).get_hedge_delay(hedge_quantile)
+
+        return run_hedged(lambda: self.post_once(data, stop_sequences), delay, self.provider)
+
+    def post_once(self, data, stop_sequences=None):
+        limiter = get_limiter(self.provider, self.url, self.api_key)
+        limiter.acquire()
+        start = time.perf_counter()
+        try:
+            stream = data.get("stream", False)
+            re = self.session.post(
+                self.url, data=json.dumps(data), timeout=(self.timeouts.get("connect"), self.timeouts.get("read")),
+                stream=stream
+            )
+            if stream and re.status_code == 200:
+                # Closing the response once the verdict is complete cancels the rest of the generation
+                with re:
+                    re.streamed_completion = read_chat_stream(iter_sse_chunks(re.iter_lines()), stop_sequences)
+        except requests.exceptions.Timeout:
+            limiter.release("throttled")
+            self.observe_request(self.api_key, start, "timeout")
+            raise
+        except requests.exceptions.ConnectionError:
+            # A refused or dropped connection counts towards opening the circuit, like a 5xx
+            limiter.release("throttled")
+            self.observe_request(self.api_key, start, "connection_error")
+            raise
+        except Exception:
+            limiter.release("error")
+            self.observe_request(self.api_key, start, "error")
+            raise
+        if re.status_code == 429 or re.status_code >= 500:
+            limiter.release("throttled", get_retry_after(re))
+        else:
+            limiter.release("success")
+            get_latency_tracker(self.provider).record(time.perf_counter() - start)
+        self.observe_request(self.api_key, start, str(re.status_code))
+
+        return re
+
+    def process_result(self, **kwargs):
+        completion = kwargs.get("completion")
+        if isinstance(completion, StreamedCompletion):
+            return self.process_streamed_result(self.api_key, **kwargs)
+
+        response = {
+            "model_name": self.model_name,
+            "model_display_name": self.model_display_name,
+            "masked_api_key": self.api_key[-5:],
+        }
+
+        if self.is_blocked_content(completion):
+            response["result"] = "[[block_reason: OTHER]]"
+            response["candidates"] = []
+
+            return response
+
+        response["info"] = {
+            'id': completion.get("id"),
+            'object': completion.get("object"),
+            'created': completion.get("created"),
+            'usage': completion.get("usage"),
+            'choices': [
+                choice
+                for choice in completion.get("choices")
+            ]
+        }
+
+        if self.type == "base":
+            response["result"] = completion["choices"][0]["text"]
+            response["candidates"] = [
+                candidate["text"]
+                for candidate in completion["choices"]
+            ]
+            return response
+        elif self.type == "chat":
+            response["result"] = completion["choices"][0]["message"]["content"]
+            response["candidates"] = [
+                candidate["message"]["content"]
+                for candidate in completion["choices"]
+            ]
+            return response
+
+    def is_blocked_content(self, completion):
+        if completion.get('error') and completion['error'].get('code') == 'content_filter':
+            return True
+        elif completion.get('choices') and completion['choices'][0].get('finish_reason') == 'content_filter':
+            return True
+        else:
+            return False
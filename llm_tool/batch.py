@@ -0,0 +1,50 @@
+import time
+
+from colorama import Fore, Style
+
+from .config import OPENAI_API_KEY, BATCH_POLL_INTERVAL
+
+
+class BatchTransport:
+    def submit(self, input_path, endpoint):
+        raise NotImplementedError
+
+    def wait(self, batch_id):
+        raise NotImplementedError
+
+
+class OpenAIBatchTransport(BatchTransport):
+    # base_url points the transport at a local stand-in of the files/batches API for testing
+    def __init__(self, api_key=None, base_url=None, poll_interval=BATCH_POLL_INTERVAL):
+        from openai import OpenAI
+
+        self.api_key = api_key or next(api_key for api_key in OPENAI_API_KEY if api_key)
+        self.client = OpenAI(api_key=self.api_key, base_url=base_url)
+        self.poll_interval = poll_interval
+
+    def submit(self, input_path, endpoint):
+        with open(input_path, "rb") as f:
+            input_file = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=endpoint,
+            completion_window="24h",
+        )
+
+        return batch.id
+
+    def wait(self, batch_id):
+        while True:
+            batch = self.client.batches.retrieve(batch_id)
+            if batch.status in ["completed", "failed", "expired", "cancelled"]:
+                break
+            print(Fore.CYAN + f"Batch {batch_id} is {batch.status}, checking again in {self.poll_interval} seconds..." + Style.RESET_ALL)
+            time.sleep(self.poll_interval)
+
+        if batch.status == "failed":
+            raise RuntimeError(f"Batch {batch_id} failed: {batch.errors}")
+        # Expired or cancelled batches still return the requests that finished, the rest are picked up by the next run
+        if batch.output_file_id is None:
+            return ""
+
+        return self.client.files.content(batch.output_file_id).text
@@ -0,0 +1,135 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from .config import RESPONSE_CACHE_PATH, RESPONSE_CACHE_MAX_BYTES
+
+
+class ResponseCache:
+    """Persistent cache of model responses, keyed on the model and every parameter that affects the answer."""
+
+    def __init__(self, path=RESPONSE_CACHE_PATH, max_bytes=RESPONSE_CACHE_MAX_BYTES, access_flush_interval=1000):
+        Path(path).parent.mkdir(exist_ok=True, parents=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        # Hits only record their access time in memory, written with the next put or flush, or every
+        # access_flush_interval hits, so that reads never wait on a commit
+        self.pending_accesses = dict()
+        self.access_flush_interval = access_flush_interval
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self.conn.commit()
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    @staticmethod
+    def make_key(model_name, prompt, temperature, candidate_count, max_output_tokens, stop_sequences=None, stream=False):
+        # Stop sequences and streaming can cut an answer short (a stream also has no logprobs), keys without them stay
+        # the same as before they existed
+        fields = [model_name, prompt, temperature, candidate_count, max_output_tokens]
+        if stop_sequences:
+            fields.append(stop_sequences)
+        if stream:
+            fields.append("stream")
+        payload = json.dumps(fields)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.pending_accesses[key] = time.time()
+            if len(self.pending_accesses) >= self.access_flush_interval:
+                self.write_accesses()
+                self.conn.commit()
+
+        return json.loads(row[0])
+
+    def write_accesses(self):
+        self.conn.executemany(
+            "UPDATE responses SET last_access = ? WHERE key = ?",
+            [(last_access, key) for key, last_access in self.pending_accesses.items()]
+        )
+        self.pending_accesses.clear()
+
+    def flush(self):
+        with self.lock:
+            if self.pending_accesses:
+                self.write_accesses()
+                self.conn.commit()
+
+    def contains(self, key):
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM responses WHERE key = ?", (key,)).fetchone() is not None
+
+    def put(self, key, response):
+        try:
+            value = json.dumps(response)
+        except TypeError:
+            # Raw SDK objects (e.g. safety ratings) can not be cached
+            return
+
+        size = len(value)
+        with self.lock:
+            old = self.conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, value, size, time.time())
+            )
+            self.total_bytes += size - (old[0] if old else 0)
+            self.pending_accesses.pop(key, None)
+            self.write_accesses()
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+            self.conn.commit()
+
+    def evict(self):
+        # Drop least recently used entries until the cache is back under 90% of its budget
+        target = self.max_bytes * 0.9
+        rows = self.conn.execute("SELECT key, size FROM responses ORDER BY last_access")
+        evicted = []
+        for key, size in rows:
+            if self.total_bytes <= target:
+                break
+            evicted.append((key,))
+            self.total_bytes -= size
+        self.conn.executemany("DELETE FROM responses WHERE key = ?", evicted)
+
+    def stats(self):
+        with self.lock:
+            num_entries = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": num_entries,
+            "bytes": self.total_bytes,
+        }
+
+
+RESPONSE_CACHE = None
+RESPONSE_CACHE_LOCK = threading.Lock()
+
+
+def get_response_cache():
+    global RESPONSE_CACHE
+    with RESPONSE_CACHE_LOCK:
+        if RESPONSE_CACHE is None:
+            RESPONSE_CACHE = ResponseCache()
+
+    return RESPONSE_CACHE
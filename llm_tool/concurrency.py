@@ -0,0 +1,103 @@
+import threading
+import time
+
+from colorama import Fore, Style
+
+from .config import MAX_CONCURRENCY, ADAPTIVE_CONCURRENCY
+from .metrics import METRICS, mask_api_key
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit with a circuit breaker, shared by every request to one endpoint and key."""
+
+    def __init__(self, name, max_limit, initial_limit=2, min_limit=1, decrease_factor=0.5,
+                 failure_threshold=5, open_seconds=30):
+        self.name = name
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.limit = float(min(initial_limit, max_limit))
+        self.decrease_factor = decrease_factor
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+
+        self.in_flight = 0
+        self.consecutive_failures = 0
+        self.paused_until = 0
+        self.open_until = 0
+        self.last_decrease = 0
+        self.condition = threading.Condition()
+
+    def get_wait_time(self, now):
+        if self.open_until > now:
+            return self.open_until - now
+        if self.paused_until > now:
+            return self.paused_until - now
+        return None
+
+    def acquire(self):
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                wait_time = self.get_wait_time(now)
+                # A circuit past its open period is half-open and lets a single probe through
+                half_open = self.consecutive_failures >= self.failure_threshold
+                limit = 1 if half_open else int(self.limit)
+                if wait_time is None and self.in_flight < limit:
+                    self.in_flight += 1
+                    return
+                self.condition.wait(wait_time)
+
+    def release(self, outcome="success", retry_after=None):
+        # outcome: success, throttled (429 or 5xx) or error (any other failure, which only frees the slot)
+        with self.condition:
+            now = time.monotonic()
+            self.in_flight -= 1
+
+            if outcome == "error":
+                pass
+            elif outcome == "success":
+                # Additive increase: about one more slot per limit's worth of successful requests
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+                if self.consecutive_failures >= self.failure_threshold:
+                    print(Fore.GREEN + f"Circuit for {self.name} closed." + Style.RESET_ALL)
+                self.consecutive_failures = 0
+            else:
+                # Multiplicative decrease, at most once per pause so a burst of 429s does not collapse the limit
+                if now >= self.last_decrease + (retry_after or 1):
+                    self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+                    self.last_decrease = now
+                if retry_after:
+                    self.paused_until = max(self.paused_until, now + retry_after)
+                self.consecutive_failures += 1
+                if self.consecutive_failures >= self.failure_threshold:
+                    self.open_until = now + self.open_seconds
+                    print(Fore.RED + f"Circuit for {self.name} open for {self.open_seconds} seconds after {self.consecutive_failures} consecutive failures." + Style.RESET_ALL)
+
+            METRICS.set("concurrency_limit", self.limit, endpoint=self.name)
+            METRICS.set("circuit_open", int(self.open_until > now), endpoint=self.name)
+            self.condition.notify_all()
+
+
+LIMITERS = dict()
+LIMITERS_LOCK = threading.Lock()
+
+# In-flight requests per provider for this run, MAX_CONCURRENCY unless --concurrency overrides it
+CONCURRENCY_LIMITS = dict(MAX_CONCURRENCY)
+
+
+def set_concurrency_limits(limits):
+    # Limiters and connection pools are sized from these when they are created, so this is set before the first request
+    CONCURRENCY_LIMITS.update(limits)
+
+
+def get_concurrency_limit(provider):
+    return CONCURRENCY_LIMITS.get(provider, 1)
+
+
+def get_limiter(provider, endpoint, api_key):
+    name = f"{provider}:{endpoint}:{mask_api_key(api_key)}"
+    with LIMITERS_LOCK:
+        if name not in LIMITERS:
+            LIMITERS[name] = AdaptiveLimiter(name, get_concurrency_limit(provider), **ADAPTIVE_CONCURRENCY)
+
+    return LIMITERS[name]
@@ -8,12 +8,13 @@ MODEL_NAME_MAPPING = {
     "Llama-2-7b-chat": "Llama-2-7b-chat",
     "Llama-2-13b-chat": "Llama-2-13b-chat",
     "Llama-2-70b-chat": "Llama-2-70b-chat",
+    "qwen2.5-0.5b-local": "Qwen/Qwen2.5-0.5B-Instruct",
 }
 BASE_MODEL_LST = ["palm2", "gemini-pro"]
-CHAT_MODEL_LST = ["gpt-3.5-1106", "Llama-2-7b-chat", "Llama-2-13b-chat", "Llama-2-70b-chat"]
+CHAT_MODEL_LST = ["gpt-3.5-1106", "Llama-2-7b-chat", "Llama-2-13b-chat", "Llama-2-70b-chat", "qwen2.5-0.5b-local"]
 
 # TODO: Add your API key here, if you have multiple keys, you can add them to the list
-# We implemented a random selection mechanism to avoid hitting the rate limit
+# Requests are routed to the key with the most remaining budget (see key_pool.py) to avoid hitting the rate limit
 GOOGLE_API_KEYS = [
     os.getenv("PALM_API_KEY"),
     os.getenv("PALM_API_KEY_2"),
@@ -30,10 +31,88 @@ AZURE_API_KEY = {
     "Llama-2-70b-chat": os.getenv("AZURE_LLAMA_70B_CHAT"),
 }
 
+# Jobs queued per provider with --async_run before the producer waits for it, the slack a fast provider has to run
+# ahead of a slow one. Bounds the memory held by queued jobs
+MAX_PROVIDER_BACKLOG = 2000
+
+# Maximum number of in-flight requests per provider when running with --async_run
+MAX_CONCURRENCY = {
+    "openai": 8,
+    "google": 4,
+    "azure": 4,
+    "local": 1,
+}
+
+# AIMD limits per endpoint and key, growing up to MAX_CONCURRENCY while requests succeed and halving on 429/5xx.
+# After failure_threshold consecutive failures the circuit opens for open_seconds
+ADAPTIVE_CONCURRENCY = {
+    "initial_limit": 2,
+    "min_limit": 1,
+    "decrease_factor": 0.5,
+    "failure_threshold": 5,
+    "open_seconds": 30,
+}
+
+# Seconds to establish a connection and to wait for a response before a request is abandoned and retried.
+# gRPC (google) has a single deadline, the read timeout is used for it
+REQUEST_TIMEOUTS = {
+    "openai": {"connect": 10, "read": 120},
+    "google": {"connect": 10, "read": 120},
+    "azure": {"connect": 10, "read": 180},
+}
+
+# Hedged requests (--hedge_quantile): a request still running after that quantile of recent latencies is sent
+# again, to another key when the provider has several, and the first answer wins
+HEDGING = {
+    "window": 500,
+    "min_samples": 20,
+    "min_delay": 0.5,
+    "max_hedges": 1,
+}
+
+# Per-key limits used by the key pool, set these to the limits of your account tier
+RATE_LIMITS = {
+    "openai": {"rpm": 3500, "tpm": 160000},
+    "google": {"rpm": 60, "tpm": None},
+    "azure": {"rpm": 1000, "tpm": 200000},
+}
+# Seconds a key is taken out of rotation after it returned 429
+KEY_COOLDOWN = float(os.getenv("LLM_KEY_COOLDOWN", 60))
+
+# Local cache of deterministic (temperature 0) responses, see cache.py
+RESPONSE_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "artifacts/llm_cache.sqlite")
+RESPONSE_CACHE_MAX_BYTES = 4 * 1024 ** 3
+
+# Seconds between status checks of submitted OpenAI batch jobs (--batch)
+BATCH_POLL_INTERVAL = 60
+# Requests per batch input file, the Batch API accepts at most 50,000
+BATCH_MAX_REQUESTS = 50000
+
+# USD per 1M input and output tokens, used by --plan to estimate the cost of a sweep. The defaults are approximate
+# list prices, edit them to match the rates of your account
+MODEL_PRICING = {
+    "palm2": {"input": 1.0, "output": 1.0},
+    "gemini-pro": {"input": 0.5, "output": 1.5},
+    "gpt-3.5-1106": {"input": 1.0, "output": 2.0},
+    "Llama-2-7b-chat": {"input": 0.52, "output": 0.67},
+    "Llama-2-13b-chat": {"input": 0.81, "output": 0.94},
+    "Llama-2-70b-chat": {"input": 1.54, "output": 1.77},
+    "qwen2.5-0.5b-local": {"input": 0, "output": 0},
+}
+
+# Local models (LocalLogprobModel) run on CPU with torch and transformers, which are only needed for them.
+# Prompts scored per forward pass, and torch threads (0 keeps the torch default)
+LOCAL_MODEL_BATCH_SIZE = 64
+LOCAL_MODEL_THREADS = int(os.getenv("LLM_LOCAL_THREADS", 0))
+
+# Replaces the Azure serverless endpoints, e.g. with the local mock server in benchmark/ (OpenAI reads OPENAI_BASE_URL itself)
+AZURE_ENDPOINT_BASE_URL = os.getenv("AZURE_ENDPOINT_BASE_URL")
+
 def get_azure_endpoint(model_name):
+    base_url = AZURE_ENDPOINT_BASE_URL or f"https://{model_name}-kw-serverless.eastus2.inference.ai.azure.com"
     if model_name in BASE_MODEL_LST:
-        return f"https://{model_name}-kw-serverless.eastus2.inference.ai.azure.com/v1/completions"
+        return f"{base_url}/v1/completions"
     elif model_name in CHAT_MODEL_LST:
-        return f"https://{model_name}-kw-serverless.eastus2.inference.ai.azure.com/v1/chat/completions"
+        return f"{base_url}/v1/chat/completions"
     else:
         raise ValueError(f"Invalid model name: {model_name}")
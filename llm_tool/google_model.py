@@ -0,0 +1,218 @@
+from google.generativeai.types import safety_types
+import google.generativeai as GoogleAI
+import google.ai.generativelanguage as glm
+import google.api_core.exceptions
+
+from .model import LLMModel
+from .utils import retry_with_exponential_backoff, register_retryable_errors
+from .streaming import StreamedCompletion, VerdictStreamParser
+
+
+register_retryable_errors(
+    google.api_core.exceptions.ResourceExhausted,
+    google.api_core.exceptions.ServiceUnavailable,
+    google.api_core.exceptions.GoogleAPIError,
+)
+
+
+class GoogleAIModel(LLMModel):
+    provider = "google"
+    rate_limit_errors = (google.api_core.exceptions.ResourceExhausted,)
+    server_errors = (
+        google.api_core.exceptions.ServiceUnavailable,
+        google.api_core.exceptions.InternalServerError,
+        google.api_core.exceptions.DeadlineExceeded,
+    )
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+
+    def create_client_options(self, api_key):
+        # Per-key clients instead of the global GoogleAI.configure, which is shared by all threads
+        return {"api_key": api_key}
+
+    def get_request_options(self):
+        return {"timeout": self.timeouts.get("read")}
+
+
+class PaLM2Model(GoogleAIModel):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+
+    @retry_with_exponential_backoff
+    def generate_base(self, **kwargs):
+        kwargs["api_key"], kwargs["completion"] = self.request_with_key(
+            lambda client: GoogleAI.generate_text(
+                client=client,
+                model=self.model_name,
+                prompt=kwargs.get("prompt", "How are you?"),
+                temperature=kwargs.get("temperature", 0),
+                candidate_count=kwargs.get("candidate_count", 5),
+                max_output_tokens=kwargs.get("max_output_tokens", 1024),
+                stop_sequences=kwargs.get("stop_sequences"),
+                safety_settings=[
+                    {
+                        "category": safety_types.HarmCategory.HARM_CATEGORY_UNSPECIFIED,
+                        "threshold": safety_types.HarmBlockThreshold.BLOCK_NONE,
+                    },
+                    {
+                        "category": safety_types.HarmCategory.HARM_CATEGORY_DEROGATORY,
+                        "threshold": safety_types.HarmBlockThreshold.BLOCK_NONE,
+                    },
+                    {
+                        "category": safety_types.HarmCategory.HARM_CATEGORY_TOXICITY,
+                        "threshold": safety_types.HarmBlockThreshold.BLOCK_NONE,
+                    },
+                    {
+                        "category": safety_types.HarmCategory.HARM_CATEGORY_VIOLENCE,
+                        "threshold": safety_types.HarmBlockThreshold.BLOCK_NONE,
+                    },
+                    {
+                        "category": safety_types.HarmCategory.HARM_CATEGORY_SEXUAL,
+                        "threshold": safety_types.HarmBlockThreshold.BLOCK_NONE,
+                    },
+                    {
+                        "category": safety_types.HarmCategory.HARM_CATEGORY_MEDICAL,
+                        "threshold": safety_types.HarmBlockThreshold.BLOCK_NONE,
+                    },
+                    {
+                        "category": safety_types.HarmCategory.HARM_CATEGORY_DANGEROUS,
+                        "threshold": safety_types.HarmBlockThreshold.BLOCK_NONE,
+                    },
+                ],
+                request_options=self.get_request_options(),
+            ),
+            **kwargs
+        )
+
+        return self.process_result(**kwargs)
+
+    @retry_with_exponential_backoff
+    def generate_chat(self, **kwargs):
+        pass
+
+    def create_client(self, api_key):
+        return glm.TextServiceClient(client_options=self.create_client_options(api_key))
+
+    def process_result(self, **kwargs):
+        completion = kwargs.get("completion")
+        ignore_safety_ratings = kwargs.get("ignore_safety_ratings", True)
+
+        if self.type == "base":
+            return {
+                "model_name": self.model_name,
+                "model_display_name": self.model_display_name,
+                "masked_api_key": kwargs["api_key"][-5:],
+                "result": completion.result,
+                "candidates": [
+                    candidate["output"]
+                    for candidate in completion.candidates
+                ] if ignore_safety_ratings else completion.candidates,
+            }
+        elif self.type == "chat":
+            raise NotImplementedError
+
+
+class GeminiModel(GoogleAIModel):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+
+    @retry_with_exponential_backoff
+    def generate_base(self, **kwargs):
+        if self.should_stream(**kwargs):
+            request = lambda model: self.stream_content(model, **kwargs)
+        else:
+            request = lambda model: model.generate_content(
+                kwargs.get("prompt", "How are you?"), **self.get_content_params(**kwargs)
+            )
+        kwargs["api_key"], kwargs["completion"] = self.request_with_key(request, **kwargs)
+
+        return self.process_result(**kwargs)
+
+    def get_content_params(self, **kwargs):
+        generation_config = {
+            'temperature': kwargs.get("temperature", 0),
+            'max_output_tokens': kwargs.get("max_output_tokens", 1024),
+        }
+        if kwargs.get("stop_sequences"):
+            generation_config['stop_sequences'] = kwargs["stop_sequences"]
+
+        return {
+            "generation_config": generation_config,
+            "safety_settings": [
+                {
+                    "category": "HARM_CATEGORY_HARASSMENT",
+                    "threshold": "BLOCK_NONE",
+                },
+                {
+                    "category": "HARM_CATEGORY_HATE_SPEECH",
+                    "threshold": "BLOCK_NONE",
+                },
+                {
+                    "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
+                    "threshold": "BLOCK_NONE",
+                },
+                {
+                    "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
+                    "threshold": "BLOCK_NONE",
+                },
+            ],
+            "request_options": self.get_request_options(),
+        }
+
+    def stream_content(self, model, **kwargs):
+        parser = VerdictStreamParser(kwargs.get("stop_sequences"))
+        completion = StreamedCompletion(model=self.model_name)
+        response = model.generate_content(
+            kwargs.get("prompt", "How are you?"), stream=True, **self.get_content_params(**kwargs)
+        )
+        for chunk in response:
+            try:
+                text = chunk.text
+            except ValueError as e:
+                if str(chunk.prompt_feedback) == "block_reason: OTHER\n":
+                    parser.text = "[[block_reason: OTHER]]"
+                    break
+                raise e
+            completion.num_chunks += 1
+            if parser.feed(text):
+                completion.cancelled = True
+                break
+        # An abandoned response stream cancels its gRPC call once it is garbage collected
+        completion.text = parser.text
+
+        return completion
+
+    def create_client(self, api_key):
+        model = GoogleAI.GenerativeModel(model_name=self.model_display_name)
+        # GenerativeModel only creates its default (globally configured) client when _client is unset
+        model._client = glm.GenerativeServiceClient(client_options=self.create_client_options(api_key))
+
+        return model
+
+    def process_result(self, **kwargs):
+        completion = kwargs.get("completion")
+        ignore_safety_ratings = kwargs.get("ignore_safety_ratings", True)
+        if isinstance(completion, StreamedCompletion):
+            return self.process_streamed_result(**kwargs)
+
+        if self.type == "base":
+            try:
+                result = completion.text
+            except Exception as e:
+                if str(completion.prompt_feedback) == "block_reason: OTHER\n":
+                    result = "[[block_reason: OTHER]]"
+                else:
+                    raise e
+            return {
+                "model_name": self.model_name,
+                "model_display_name": self.model_display_name,
+                "masked_api_key": kwargs["api_key"][-5:],
+                "result": result,
+                "candidates":  [
+                    candidate.content.parts[0].text
+                    for candidate in completion.candidates
+                ] if ignore_safety_ratings else completion.candidates,
+            }
+        elif self.type == "chat":
+            raise NotImplementedError
@@ -0,0 +1,93 @@
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from .config import HEDGING
+from .concurrency import CONCURRENCY_LIMITS
+from .metrics import METRICS
+
+
+class LatencyTracker:
+    """Sliding window of recent successful request latencies, used to pick when to hedge."""
+
+    def __init__(self, window=500, min_samples=20, min_delay=0.5):
+        self.latencies = deque(maxlen=window)
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.lock = threading.Lock()
+
+    def record(self, seconds):
+        with self.lock:
+            self.latencies.append(seconds)
+
+    def get_hedge_delay(self, quantile):
+        # No hedging until there are enough samples for the quantile to mean something
+        if quantile is None:
+            return None
+        with self.lock:
+            if len(self.latencies) < self.min_samples:
+                return None
+            latencies = sorted(self.latencies)
+
+        return max(self.min_delay, latencies[min(len(latencies) - 1, int(quantile * len(latencies)))])
+
+
+LATENCY_TRACKERS = dict()
+LATENCY_TRACKERS_LOCK = threading.Lock()
+
+HEDGE_EXECUTOR = None
+HEDGE_EXECUTOR_LOCK = threading.Lock()
+
+
+def get_latency_tracker(provider):
+    with LATENCY_TRACKERS_LOCK:
+        if provider not in LATENCY_TRACKERS:
+            LATENCY_TRACKERS[provider] = LatencyTracker(
+                HEDGING["window"], HEDGING["min_samples"], HEDGING["min_delay"]
+            )
+
+    return LATENCY_TRACKERS[provider]
+
+
+def get_hedge_executor():
+    # Attempts run here so that the calling thread can wait on the first of them to finish. It is created on the first
+    # hedged request, once the run's concurrency is known, with room for every in-flight request and all its hedges
+    global HEDGE_EXECUTOR
+    with HEDGE_EXECUTOR_LOCK:
+        if HEDGE_EXECUTOR is None:
+            HEDGE_EXECUTOR = ThreadPoolExecutor(
+                max_workers=sum(CONCURRENCY_LIMITS.values()) * (1 + HEDGING["max_hedges"]), thread_name_prefix="hedge"
+            )
+
+    return HEDGE_EXECUTOR
+
+
+def run_hedged(attempt, delay, provider, max_hedges=HEDGING["max_hedges"]):
+    """Call attempt(), starting a duplicate whenever none has finished after delay seconds, and return the first success.
+
+    The provider SDKs cannot cancel a request in flight, so slower attempts run to completion and their answers are dropped.
+    """
+    if delay is None:
+        return attempt()
+
+    executor = get_hedge_executor()
+    primary = executor.submit(attempt)
+    pending = {primary}
+    num_hedges = 0
+    error = None
+    while pending:
+        timeout = delay if num_hedges < max_hedges else None
+        done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                if future is not primary:
+                    METRICS.inc("llm_hedge_wins_total", provider=provider)
+                return future.result()
+            error = error or future.exception()
+
+        if not done and num_hedges < max_hedges:
+            num_hedges += 1
+            METRICS.inc("llm_hedged_requests_total", provider=provider)
+            pending.add(executor.submit(attempt))
+
+    raise error
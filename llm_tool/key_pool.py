@@ -0,0 +1,130 @@
+import threading
+import time
+
+from .config import GOOGLE_API_KEYS, OPENAI_API_KEY, RATE_LIMITS, KEY_COOLDOWN
+
+
+class TokenBucket:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.tokens = capacity
+        self.refill_rate = capacity / 60
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_rate)
+        self.updated = now
+
+    def fraction(self):
+        return self.tokens / self.capacity
+
+    def wait_time(self, amount):
+        if self.tokens >= amount:
+            return 0
+        return (amount - self.tokens) / self.refill_rate
+
+
+class APIKeyState:
+    def __init__(self, api_key, rpm, tpm):
+        self.api_key = api_key
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.cooldown_until = 0
+
+    def refill(self, now):
+        self.requests.refill(now)
+        if self.tokens is not None:
+            self.tokens.refill(now)
+
+    def budget(self):
+        if self.tokens is None:
+            return self.requests.fraction()
+        return min(self.requests.fraction(), self.tokens.fraction())
+
+    def wait_time(self, now, num_tokens):
+        if self.cooldown_until > now:
+            return self.cooldown_until - now
+        wait = self.requests.wait_time(1)
+        if self.tokens is not None:
+            # A request larger than the whole bucket can only wait for a full bucket
+            wait = max(wait, self.tokens.wait_time(min(num_tokens, self.tokens.capacity)))
+        return wait
+
+    def consume(self, num_tokens):
+        self.requests.tokens -= 1
+        if self.tokens is not None:
+            self.tokens.tokens -= num_tokens
+
+
+class KeyPool:
+    """Route each request to the API key with the most remaining per-minute budget."""
+
+    def __init__(self, api_keys, rpm, tpm=None, cooldown=KEY_COOLDOWN):
+        api_keys = [api_key for api_key in api_keys if api_key]
+        if not api_keys:
+            raise ValueError("At least one API key must be configured")
+
+        self.states = {
+            api_key: APIKeyState(api_key, rpm, tpm)
+            for api_key in dict.fromkeys(api_keys)
+        }
+        self.cooldown = cooldown
+        self.lock = threading.Lock()
+
+    def acquire(self, num_tokens=0):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                for state in self.states.values():
+                    state.refill(now)
+
+                available = [
+                    state for state in self.states.values()
+                    if state.wait_time(now, num_tokens) == 0
+                ]
+                if available:
+                    state = max(available, key=lambda state: state.budget())
+                    state.consume(num_tokens)
+                    return state.api_key
+
+                wait = min(state.wait_time(now, num_tokens) for state in self.states.values())
+            time.sleep(wait)
+
+    def report_usage(self, api_key, num_tokens, estimated_tokens=0):
+        # Correct the estimate taken in acquire with the usage reported by the API
+        state = self.states[api_key]
+        if state.tokens is not None and num_tokens is not None:
+            with self.lock:
+                state.tokens.tokens -= num_tokens - estimated_tokens
+
+    def report_rate_limited(self, api_key, retry_after=None):
+        with self.lock:
+            self.states[api_key].cooldown_until = time.monotonic() + (retry_after or self.cooldown)
+
+    def all_cooling_down(self):
+        with self.lock:
+            now = time.monotonic()
+            return all(state.cooldown_until > now for state in self.states.values())
+
+
+KEY_POOLS = {}
+KEY_POOL_LOCK = threading.Lock()
+
+
+def get_key_pool(provider):
+    with KEY_POOL_LOCK:
+        if provider not in KEY_POOLS:
+            if provider == "openai":
+                api_keys = OPENAI_API_KEY
+            elif provider == "google":
+                api_keys = GOOGLE_API_KEYS
+            else:
+                raise ValueError(f"No key pool for provider: {provider}")
+            KEY_POOLS[provider] = KeyPool(api_keys, **RATE_LIMITS[provider])
+
+    return KEY_POOLS[provider]
+
+
+def estimate_tokens(prompt, max_output_tokens=0):
+    # Rough 4 characters per token heuristic, corrected by report_usage once the response arrives
+    return len(prompt) // 4 + max_output_tokens
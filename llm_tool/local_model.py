@@ -0,0 +1,110 @@
+import math
+import threading
+import time
+
+from .model import LLMModel
+from .config import LOCAL_MODEL_BATCH_SIZE, LOCAL_MODEL_THREADS
+
+
+class LocalLogprobModel(LLMModel):
+    """Small causal LM on CPU that scores the choice symbols instead of generating an explanation."""
+
+    provider = "local"
+    batched_scoring = True
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # Imported here so that runs against the APIs do not need torch and transformers
+        import torch
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+
+        self.torch = torch
+        if LOCAL_MODEL_THREADS:
+            torch.set_num_threads(LOCAL_MODEL_THREADS)
+
+        # Left padding keeps the last prompt token of every row at position -1
+        self.tokenizer = AutoTokenizer.from_pretrained(self.model_name, padding_side="left")
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        self.model = AutoModelForCausalLM.from_pretrained(self.model_name, torch_dtype=torch.float32)
+        self.model.eval()
+        self.model_lock = threading.Lock()
+        self.symbol_token_ids = {}
+
+    def generate_base(self, **kwargs):
+        return self.score_batch([kwargs])[0]
+
+    def generate_chat(self, **kwargs):
+        return self.score_batch([kwargs])[0]
+
+    def build_input(self, prompt, logprob_answer=False):
+        if self.type == "chat":
+            prompt = self.tokenizer.apply_chat_template(
+                [{"role": "user", "content": prompt}], tokenize=False, add_generation_prompt=True
+            )
+        # Unless the prompt asks for the bare symbol, it asks for a [[X]] verdict and the symbol follows the opening brackets
+        return prompt if logprob_answer else prompt + "[["
+
+    def get_symbol_token_id(self, symbol):
+        if symbol not in self.symbol_token_ids:
+            self.symbol_token_ids[symbol] = self.tokenizer.encode(symbol, add_special_tokens=False)[0]
+
+        return self.symbol_token_ids[symbol]
+
+    def score_batch(self, kwargs_lst):
+        results = []
+        for start in range(0, len(kwargs_lst), LOCAL_MODEL_BATCH_SIZE):
+            chunk = kwargs_lst[start:start + LOCAL_MODEL_BATCH_SIZE]
+            inputs = self.tokenizer(
+                [self.build_input(kwargs["prompt"], kwargs.get("logprob_answer")) for kwargs in chunk],
+                return_tensors="pt", padding=True
+            )
+
+            request_start = time.perf_counter()
+            with self.model_lock, self.torch.inference_mode():
+                logits = self.model(**inputs).logits[:, -1, :]
+            self.observe_request(None, request_start, "success")
+
+            logprobs = self.torch.log_softmax(logits.float(), dim=-1)
+            prompt_tokens = inputs["attention_mask"].sum(dim=1).tolist()
+            for i, kwargs in enumerate(chunk):
+                completion = {"logprobs": logprobs[i], "prompt_tokens": prompt_tokens[i]}
+                results.append(self.process_result(**{**kwargs, "completion": completion}))
+
+        return results
+
+    def process_result(self, **kwargs):
+        completion = kwargs.get("completion")
+        symbols = kwargs.get("choice_symbols")
+        if not symbols:
+            raise ValueError("choice_symbols must be specified")
+
+        symbol_logprobs = {
+            symbol: completion["logprobs"][self.get_symbol_token_id(symbol)].item()
+            for symbol in symbols
+        }
+        # Renormalize over the choice symbols, the rest of the vocabulary is not a valid answer
+        max_logprob = max(symbol_logprobs.values())
+        normalizer = max_logprob + math.log(sum(math.exp(logprob - max_logprob) for logprob in symbol_logprobs.values()))
+        distribution = {
+            symbol: math.exp(logprob - normalizer)
+            for symbol, logprob in symbol_logprobs.items()
+        }
+        answer = max(distribution, key=distribution.get)
+
+        return {
+            "model_name": self.model_name,
+            "model_display_name": self.model_display_name,
+            "masked_api_key": None,
+            "result": f"[[{answer}]]",
+            "candidates": [f"[[{answer}]]"],
+            "info": {
+                "usage": {
+                    "completion_tokens": 0,
+                    "prompt_tokens": completion["prompt_tokens"],
+                    "total_tokens": completion["prompt_tokens"],
+                },
+                "symbol_logprobs": symbol_logprobs,
+                "symbol_distribution": distribution,
+            }
+        }
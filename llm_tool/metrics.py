@@ -0,0 +1,138 @@
+import json
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+
+
+LATENCY_BUCKETS = [0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, float("inf")]
+
+
+class Metrics:
+    """Thread-safe counters, gauges and histograms, exported in Prometheus text format or as JSON."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.counters = defaultdict(float)
+        self.gauges = dict()
+        self.histograms = dict()
+
+    @staticmethod
+    def get_key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        with self.lock:
+            self.counters[self.get_key(name, labels)] += value
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.gauges[self.get_key(name, labels)] = value
+
+    def add(self, name, value, **labels):
+        key = self.get_key(name, labels)
+        with self.lock:
+            self.gauges[key] = self.gauges.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = self.get_key(name, labels)
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = {"buckets": [0] * len(LATENCY_BUCKETS), "sum": 0, "count": 0}
+            histogram = self.histograms[key]
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if value <= bound:
+                    histogram["buckets"][i] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    @staticmethod
+    def format_labels(labels, **extra):
+        labels = list(labels) + list(extra.items())
+        if not labels:
+            return ""
+        return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+    def to_prometheus(self):
+        lines = []
+        with self.lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                lines.append(f"{name}{self.format_labels(labels)} {value}")
+            for (name, labels), value in sorted(self.gauges.items()):
+                lines.append(f"{name}{self.format_labels(labels)} {value}")
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                for bound, count in zip(LATENCY_BUCKETS, histogram["buckets"]):
+                    le = "+Inf" if bound == float("inf") else bound
+                    lines.append(f"{name}_bucket{self.format_labels(labels, le=le)} {count}")
+                lines.append(f"{name}_sum{self.format_labels(labels)} {histogram['sum']}")
+                lines.append(f"{name}_count{self.format_labels(labels)} {histogram['count']}")
+
+        return "\n".join(lines) + "\n"
+
+    def to_json(self):
+        def entry(name, labels, **values):
+            return {"name": name, "labels": dict(labels), **values}
+
+        with self.lock:
+            elapsed = time.time() - self.started
+            jobs_completed = sum(value for (name, _), value in self.counters.items() if name == "jobs_completed_total")
+            snapshot = {
+                "timestamp": time.time(),
+                "elapsed_seconds": elapsed,
+                "jobs_per_second": jobs_completed / elapsed if elapsed > 0 else 0,
+                "counters": [entry(name, labels, value=value) for (name, labels), value in sorted(self.counters.items())],
+                "gauges": [entry(name, labels, value=value) for (name, labels), value in sorted(self.gauges.items())],
+                "histograms": [
+                    entry(name, labels, buckets=dict(zip(map(str, LATENCY_BUCKETS), histogram["buckets"])),
+                          sum=histogram["sum"], count=histogram["count"])
+                    for (name, labels), histogram in sorted(self.histograms.items())
+                ],
+            }
+
+        return json.dumps(snapshot, indent=4)
+
+    def export(self, path):
+        path = Path(path)
+        content = self.to_prometheus() if path.suffix == ".prom" else self.to_json()
+        # Write and rename so a scraper never reads a half written file
+        tmp_path = path.with_name(path.name + ".tmp")
+        tmp_path.write_text(content)
+        tmp_path.replace(path)
+
+
+class MetricsExporter:
+    def __init__(self, metrics, path, interval=15):
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.metrics.export(self.path)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.metrics.export(self.path)
+
+
+METRICS = Metrics()
+
+
+def mask_api_key(api_key):
+    return api_key[-5:] if api_key else "none"
@@ -1,23 +1,26 @@
-import random
+import asyncio
 import os
 import sys
-import json
-import requests
-from datetime import datetime
-
-from openai import OpenAI
-from google.generativeai.types import safety_types
-import google.generativeai as GoogleAI
+import threading
+import time
 
 sys.path.append(os.path.join(os.path.dirname(__file__), "."))
-from .utils import retry_with_exponential_backoff, AzureRateLimitError, AzureServerError
-from config import MODEL_NAME_MAPPING, \
-    GOOGLE_API_KEYS, OPENAI_API_KEY, AZURE_API_KEY, \
-    BASE_MODEL_LST, CHAT_MODEL_LST, \
-    get_azure_endpoint
+from .utils import get_retry_after
+from .concurrency import get_limiter
+from .hedging import get_latency_tracker, run_hedged
+from .key_pool import get_key_pool, estimate_tokens
+from .cache import get_response_cache
+from .metrics import METRICS, mask_api_key
+from config import MODEL_NAME_MAPPING, BASE_MODEL_LST, CHAT_MODEL_LST, REQUEST_TIMEOUTS
 
 
 class LLMModel:
+    provider = None
+    rate_limit_errors = ()
+    server_errors = ()
+    # Models that score a list of prompts at once (score_batch) get every job of a doc in one call
+    batched_scoring = False
+
     def __init__(self, **kwargs):
         self.model_display_name = kwargs.get("model_name")
         self.model_name = MODEL_NAME_MAPPING.get(self.model_display_name)
@@ -31,360 +34,137 @@ class LLMModel:
         else:
             raise ValueError("model_name must be a valid model name")
 
+        # One client per API key, kept alive for the lifetime of the model
+        self.clients = {}
+        self.clients_lock = threading.Lock()
+        self.timeouts = REQUEST_TIMEOUTS.get(self.provider, {})
+
     def generate(self, **kwargs):
         if kwargs.get("prompt") is None:
             raise ValueError("prompt must be specified")
 
-        if self.type == "base":
-            return self.generate_base(**kwargs)
-        elif self.type == "chat":
-            return self.generate_chat(**kwargs)
-
-    def generate_base(self, **kwargs):
-        raise NotImplementedError
-
-    def generate_chat(self, **kwargs):
-        raise NotImplementedError
-
-    def get_client(self):
-        raise NotImplementedError
-
-    def process_result(self, **kwargs):
-        raise NotImplementedError
-
-
-class OpenAIModel(LLMModel):
-    # Text Completion Docs: https://platform.openai.com/docs/api-reference/completions/create
-    # Chat Completion Docs: https://platform.openai.com/docs/api-reference/chat/create
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-
-    @retry_with_exponential_backoff
-    def generate_base(self, **kwargs):
-        client = self.get_client()
-
-        kwargs["completion"] = client.completions.create(
-            model=self.model_name,
-            prompt=kwargs.get("prompt", "How are you?"),
-            temperature=kwargs.get("temperature", 0),
-            logprobs=kwargs.get("logprobs", 5),
-            n=kwargs.get("candidate_count", 1),
-        )
-
-        return self.process_result(**kwargs)
-
-    @retry_with_exponential_backoff
-    def generate_chat(self, **kwargs):
-        client = self.get_client()
-
-        kwargs["completion"] = client.chat.completions.create(
-            model=self.model_name,
-            messages=[
-                {"role": "user", "content": kwargs.get("prompt", "How are you?")}
-            ],
-            temperature=kwargs.get("temperature", 0),
-            logprobs=True,
-            top_logprobs=kwargs.get("logprobs", 5),
-            n=kwargs.get("candidate_count", 1),
-        )
-
-        return self.process_result(**kwargs)
-
-    def get_client(self):
-        self.api_key = random.choice(OPENAI_API_KEY)
-        client = OpenAI(api_key=self.api_key)
-
-        return client
-
-    def process_result(self, **kwargs):
-        completion = kwargs.get("completion")
-
-        if self.type == "base":
-            return {
-                "model_name": completion.model,
-                "model_display_name": self.model_display_name,
-                "masked_api_key": self.api_key[-5:],
-                "result": completion.choices[0].text,
-                "candidates": [choice.text for choice in completion.choices],
-                "info": {
-                    'id': completion.id,
-                    'object': completion.object,
-                    'created': completion.created,
-                    'usage': {
-                        'completion_tokens': completion.usage.completion_tokens,
-                        'prompt_tokens': completion.usage.prompt_tokens,
-                        'total_tokens': completion.usage.total_tokens
-                    },
-                    'choices': [
-                        json.loads(choice.model_dump_json())
-                        for choice in completion.choices
-                    ]
-                }
-            }
-        elif self.type == "chat":
-            return {
-                "model_name": completion.model,
-                "model_display_name": self.model_display_name,
-                "masked_api_key": self.api_key[-5:],
-                "result": completion.choices[0].message.content,
-                "candidates": [choice.message.content for choice in completion.choices],
-                "info": {
-                    'id': completion.id,
-                    'object': completion.object,
-                    'created': completion.created,
-                    'system_fingerprint': completion.system_fingerprint,
-                    'usage': {
-                        'completion_tokens': completion.usage.completion_tokens,
-                        'prompt_tokens': completion.usage.prompt_tokens,
-                        'total_tokens': completion.usage.total_tokens
-                    },
-                    'choices': [
-                        json.loads(choice.model_dump_json())
-                        for choice in completion.choices
-                    ]
-                }
-            }
-
-
-class GoogleAIModel(LLMModel):
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self.model_random_seed = datetime.now().timestamp()
-
-    def get_client(self):
-        random.seed(self.model_random_seed + datetime.now().timestamp())
-        self.api_key = random.choice(GOOGLE_API_KEYS)
-        GoogleAI.configure(api_key=self.api_key)
-
-        return GoogleAI
-
-
-class PaLM2Model(GoogleAIModel):
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-
-    @retry_with_exponential_backoff
-    def generate_base(self, **kwargs):
-        client = self.get_client()
-
-        kwargs["completion"] = client.generate_text(
-            model=self.model_name,
-            prompt=kwargs.get("prompt", "How are you?"),
-            temperature=kwargs.get("temperature", 0),
-            candidate_count=kwargs.get("candidate_count", 5),
-            max_output_tokens=kwargs.get("max_output_tokens", 1024),
-            safety_settings=[
-                {
-                    "category": safety_types.HarmCategory.HARM_CATEGORY_UNSPECIFIED,
-                    "threshold": safety_types.HarmBlockThreshold.BLOCK_NONE,
-                },
-                {
-                    "category": safety_types.HarmCategory.HARM_CATEGORY_DEROGATORY,
-                    "threshold": safety_types.HarmBlockThreshold.BLOCK_NONE,
-                },
-                {
-                    "category": safety_types.HarmCategory.HARM_CATEGORY_TOXICITY,
-                    "threshold": safety_types.HarmBlockThreshold.BLOCK_NONE,
-                },
-                {
-                    "category": safety_types.HarmCategory.HARM_CATEGORY_VIOLENCE,
-                    "threshold": safety_types.HarmBlockThreshold.BLOCK_NONE,
-                },
-                {
-                    "category": safety_types.HarmCategory.HARM_CATEGORY_SEXUAL,
-                    "threshold": safety_types.HarmBlockThreshold.BLOCK_NONE,
-                },
-                {
-                    "category": safety_types.HarmCategory.HARM_CATEGORY_MEDICAL,
-                    "threshold": safety_types.HarmBlockThreshold.BLOCK_NONE,
-                },
-                {
-                    "category": safety_types.HarmCategory.HARM_CATEGORY_DANGEROUS,
-                    "threshold": safety_types.HarmBlockThreshold.BLOCK_NONE,
-                },
-            ]
-        )
-
-        return self.process_result(**kwargs)
-
-    @retry_with_exponential_backoff
-    def generate_chat(self, **kwargs):
-        pass
-
-    def process_result(self, **kwargs):
-        completion = kwargs.get("completion")
-        ignore_safety_ratings = kwargs.get("ignore_safety_ratings", True)
+        # Only deterministic calls are cached, sampling at temperature > 0 should give a new answer
+        use_cache = kwargs.get("use_cache", True) and kwargs.get("temperature", 0) == 0
+        if use_cache:
+            cache = get_response_cache()
+            cache_key = cache.make_key(
+                self.model_name,
+                kwargs["prompt"],
+                kwargs.get("temperature", 0),
+                kwargs.get("candidate_count"),
+                kwargs.get("max_output_tokens"),
+                kwargs.get("stop_sequences"),
+                self.should_stream(**kwargs),
+            )
+            result = cache.get(cache_key)
+            METRICS.inc("llm_cache_lookups_total", result="hit" if result is not None else "miss")
+            if result is not None:
+                return result
 
         if self.type == "base":
-            return {
-                "model_name": self.model_name,
-                "model_display_name": self.model_display_name,
-                "masked_api_key": self.api_key[-5:],
-                "result": completion.result,
-                "candidates": [
-                    candidate["output"]
-                    for candidate in completion.candidates
-                ] if ignore_safety_ratings else completion.candidates,
-            }
+            result = self.generate_base(**kwargs)
         elif self.type == "chat":
-            raise NotImplementedError
+            result = self.generate_chat(**kwargs)
 
+        usage = (result.get("info") or {}).get("usage") or {}
+        for token_type in ["prompt_tokens", "completion_tokens"]:
+            if usage.get(token_type):
+                METRICS.inc("llm_tokens_total", usage[token_type], model=self.model_display_name, type=token_type)
 
-class GeminiModel(GoogleAIModel):
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
+        if use_cache:
+            cache.put(cache_key, result)
 
-    @retry_with_exponential_backoff
-    def generate_base(self, **kwargs):
-        client = self.get_client()
-        model = client.GenerativeModel(model_name=self.model_display_name)
+        return result
 
-        kwargs["completion"] = model.generate_content(
-            kwargs.get("prompt", "How are you?"),
-            generation_config={
-                'temperature': kwargs.get("temperature", 0),
-                'max_output_tokens': kwargs.get("max_output_tokens", 1024),
-            },
-            safety_settings=[
-                {
-                    "category": "HARM_CATEGORY_HARASSMENT",
-                    "threshold": "BLOCK_NONE",
-                },
-                {
-                    "category": "HARM_CATEGORY_HATE_SPEECH",
-                    "threshold": "BLOCK_NONE",
-                },
-                {
-                    "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                    "threshold": "BLOCK_NONE",
-                },
-                {
-                    "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
-                    "threshold": "BLOCK_NONE",
-                },
-            ]
+    def observe_request(self, api_key, start, status):
+        METRICS.observe(
+            "llm_request_seconds", time.perf_counter() - start,
+            provider=self.provider, key=mask_api_key(api_key), status=status
         )
 
-        return self.process_result(**kwargs)
+    async def agenerate(self, **kwargs):
+        # The provider SDKs are blocking, so the call (including its retries) runs in a worker thread
+        return await asyncio.to_thread(self.generate, **kwargs)
 
-    def process_result(self, **kwargs):
-        completion = kwargs.get("completion")
-        ignore_safety_ratings = kwargs.get("ignore_safety_ratings", True)
-
-        if self.type == "base":
-            try:
-                result = completion.text
-            except Exception as e:
-                if str(completion.prompt_feedback) == "block_reason: OTHER\n":
-                    result = "[[block_reason: OTHER]]"
-                else:
-                    raise e
-            return {
-                "model_name": self.model_name,
-                "model_display_name": self.model_display_name,
-                "masked_api_key": self.api_key[-5:],
-                "result": result,
-                "candidates":  [
-                    candidate.content.parts[0].text
-                    for candidate in completion.candidates
-                ] if ignore_safety_ratings else completion.candidates,
-            }
-        elif self.type == "chat":
-            raise NotImplementedError
-
-
-class LlamaModel(LLMModel):
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self.url = get_azure_endpoint(self.model_display_name)
-        self.api_key = AZURE_API_KEY[self.model_display_name]
-        self.headers = {'Content-Type':'application/json', 'Authorization':('Bearer '+ self.api_key)}
-
-    @retry_with_exponential_backoff
     def generate_base(self, **kwargs):
-        data =  {
-            "prompt": kwargs.get("prompt", "How are you?"),
-            "temperature": kwargs.get("temperature", 0),
-            "max_tokens": kwargs.get("max_output_tokens", 1024),
-            "n": kwargs.get("candidate_count", 1),
-            "logprobs": kwargs.get("logprobs", 5)
-        }
-
-        re = requests.post(self.url, headers=self.headers, data=json.dumps(data))
-        kwargs["completion"] = json.loads(re.text)
-
-        return self.process_result(**kwargs)
+        raise NotImplementedError
 
-    @retry_with_exponential_backoff
     def generate_chat(self, **kwargs):
-        data =  {
-            "messages": [
-                {
-                "role": "user",
-                "content": kwargs.get("prompt", "How are you?"),
-                }
-            ],
-            "temperature": kwargs.get("temperature", 0),
-            "max_tokens": kwargs.get("max_output_tokens", 1024),
-            "n": kwargs.get("candidate_count", 1),
-            "logprobs": kwargs.get("logprobs", 5) # not supported yet
-        }
-
-        re = requests.post(self.url, headers=self.headers, data=json.dumps(data))
-        kwargs["completion"] = json.loads(re.text)
-
-        if re.status_code == 429 and kwargs["completion"]["message"].startswith("Rate Limit"):
-            raise AzureRateLimitError
-        elif re.status_code == 500:
-            raise AzureServerError
+        raise NotImplementedError
 
-        return self.process_result(**kwargs)
+    def should_stream(self, **kwargs):
+        # Only a single free-text answer is worth streaming, a symbol_only answer is a few tokens anyway
+        return kwargs.get("stream", False) and kwargs.get("candidate_count", 1) == 1 and not kwargs.get("logprob_answer")
 
-    def process_result(self, **kwargs):
+    def process_streamed_result(self, api_key, **kwargs):
         completion = kwargs.get("completion")
+        if completion.cancelled:
+            METRICS.inc("llm_streams_cancelled_total", provider=self.provider)
 
-        response = {
-            "model_name": self.model_name,
+        return {
+            "model_name": completion.model or self.model_name,
             "model_display_name": self.model_display_name,
-            "masked_api_key": self.api_key[-5:],
+            "masked_api_key": api_key[-5:],
+            "result": completion.text,
+            "candidates": [completion.text],
+            "info": completion.to_info(),
         }
 
-        if self.is_blocked_content(completion):
-            response["result"] = "[[block_reason: OTHER]]"
-            response["candidates"] = []
+    def get_client(self, api_key):
+        with self.clients_lock:
+            if api_key not in self.clients:
+                self.clients[api_key] = self.create_client(api_key)
 
-            return response
+            return self.clients[api_key]
 
-        response["info"] = {
-            'id': completion.get("id"),
-            'object': completion.get("object"),
-            'created': completion.get("created"),
-            'usage': completion.get("usage"),
-            'choices': [
-                choice
-                for choice in completion.get("choices")
-            ]
-        }
+    def create_client(self, api_key):
+        raise NotImplementedError
 
-        if self.type == "base":
-            response["result"] = completion["choices"][0]["text"]
-            response["candidates"] = [
-                candidate["text"]
-                for candidate in completion["choices"]
-            ]
-            return response
-        elif self.type == "chat":
-            response["result"] = completion["choices"][0]["message"]["content"]
-            response["candidates"] = [
-                candidate["message"]["content"]
-                for candidate in completion["choices"]
-            ]
-            return response
+    def get_total_tokens(self, completion):
+        return None
+
+    def request_with_key(self, request, **kwargs):
+        # With hedge_quantile, a slow request is duplicated on the key with the most budget left at that time
+        delay = get_latency_tracker(self.provider).get_hedge_delay(kwargs.get("hedge_quantile"))
+
+        return run_hedged(lambda: self.request_once(request, **kwargs), delay, self.provider)
+
+    def request_once(self, request, **kwargs):
+        key_pool = get_key_pool(self.provider)
+        estimated_tokens = estimate_tokens(kwargs.get("prompt", ""), kwargs.get("max_output_tokens", 0))
+        api_key = key_pool.acquire(estimated_tokens)
+
+        limiter = get_limiter(self.provider, self.model_name, api_key)
+        limiter.acquire()
+        start = time.perf_counter()
+        try:
+            completion = request(self.get_client(api_key))
+        except self.rate_limit_errors as e:
+            retry_after = get_retry_after(e)
+            limiter.release("throttled", retry_after)
+            self.observe_request(api_key, start, "rate_limited")
+            METRICS.inc("llm_rate_limited_total", provider=self.provider, key=mask_api_key(api_key))
+            key_pool.report_rate_limited(api_key, retry_after)
+            # Another key takes the request at once, retry_with_exponential_backoff only backs off once every key is
+            # cooling down. Each failover cools a key down, so this ends after at most one attempt per key
+            if not key_pool.all_cooling_down():
+                METRICS.inc("llm_key_failovers_total", provider=self.provider)
+                return self.request_once(request, **kwargs)
+            raise
+        except self.server_errors:
+            limiter.release("throttled")
+            self.observe_request(api_key, start, "server_error")
+            raise
+        except Exception:
+            limiter.release("error")
+            self.observe_request(api_key, start, "error")
+            raise
+        limiter.release("success")
+        self.observe_request(api_key, start, "success")
+        get_latency_tracker(self.provider).record(time.perf_counter() - start)
+
+        key_pool.report_usage(api_key, self.get_total_tokens(completion), estimated_tokens)
+        return api_key, completion
 
-    def is_blocked_content(self, completion):
-        if completion.get('error') and completion['error'].get('code') == 'content_filter':
-            return True
-        elif completion.get('choices') and completion['choices'][0].get('finish_reason') == 'content_filter':
-            return True
-        else:
-            return False
+    def process_result(self, **kwargs):
+        raise NotImplementedError
@@ -0,0 +1,169 @@
+import json
+
+import openai
+from openai import OpenAI
+
+from .model import LLMModel
+from .utils import retry_with_exponential_backoff, register_retryable_errors
+from .streaming import StreamedCompletion, read_chat_stream
+
+
+register_retryable_errors(openai.RateLimitError, openai.APIError)
+
+
+class OpenAIModel(LLMModel):
+    # Text Completion Docs: https://platform.openai.com/docs/api-reference/completions/create
+    # Chat Completion Docs: https://platform.openai.com/docs/api-reference/chat/create
+    provider = "openai"
+    rate_limit_errors = (openai.RateLimitError,)
+    # APIConnectionError includes timeouts and refused connections, the usual sign of an outage
+    server_errors = (openai.InternalServerError, openai.APIConnectionError)
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+
+    @retry_with_exponential_backoff
+    def generate_base(self, **kwargs):
+        kwargs["api_key"], kwargs["completion"] = self.request_with_key(
+            lambda client: client.completions.create(**self.get_base_params(**kwargs)),
+            **kwargs
+        )
+
+        return self.process_result(**kwargs)
+
+    @retry_with_exponential_backoff
+    def generate_chat(self, **kwargs):
+        if self.should_stream(**kwargs):
+            request = lambda client: self.stream_chat(client, **kwargs)
+        else:
+            request = lambda client: client.chat.completions.create(**self.get_chat_params(**kwargs))
+        kwargs["api_key"], kwargs["completion"] = self.request_with_key(request, **kwargs)
+
+        return self.process_result(**kwargs)
+
+    def stream_chat(self, client, **kwargs):
+        params = self.get_chat_params(**kwargs)
+        # The verdict is read from the text, the logprobs of a streamed answer are not needed
+        params.pop("logprobs")
+        params.pop("top_logprobs")
+        # Leaving the with block closes the HTTP response, which cancels the rest of the generation
+        with client.chat.completions.create(**params, stream=True, stream_options={"include_usage": True}) as stream:
+            return read_chat_stream((chunk.model_dump() for chunk in stream), kwargs.get("stop_sequences"))
+
+    def get_base_params(self, **kwargs):
+        params = {
+            "model": self.model_name,
+            "prompt": kwargs.get("prompt", "How are you?"),
+            "temperature": kwargs.get("temperature", 0),
+            "logprobs": kwargs.get("logprobs", 5),
+            "n": kwargs.get("candidate_count", 1),
+        }
+        # Single symbol answers are read from the logprobs, so only the first few tokens are needed
+        if kwargs.get("logprob_answer"):
+            params["max_tokens"] = kwargs.get("max_output_tokens")
+        if kwargs.get("stop_sequences"):
+            params["stop"] = kwargs["stop_sequences"]
+
+        return params
+
+    def get_chat_params(self, **kwargs):
+        params = {
+            "model": self.model_name,
+            "messages": [
+                {"role": "user", "content": kwargs.get("prompt", "How are you?")}
+            ],
+            "temperature": kwargs.get("temperature", 0),
+            "logprobs": True,
+            "top_logprobs": kwargs.get("logprobs", 5),
+            "n": kwargs.get("candidate_count", 1),
+        }
+        if kwargs.get("logprob_answer"):
+            # 20 is the most the API returns, enough to cover every choice symbol
+            params["max_tokens"] = kwargs.get("max_output_tokens")
+            params["top_logprobs"] = 20
+        if kwargs.get("stop_sequences"):
+            params["stop"] = kwargs["stop_sequences"]
+
+        return params
+
+    # Batch API Docs: https://platform.openai.com/docs/api-reference/batch
+    def build_batch_request(self, custom_id, **kwargs):
+        if self.type == "base":
+            url, body = "/v1/completions", self.get_base_params(**kwargs)
+        elif self.type == "chat":
+            url, body = "/v1/chat/completions", self.get_chat_params(**kwargs)
+
+        return {"custom_id": custom_id, "method": "POST", "url": url, "body": body}
+
+    def process_batch_response(self, response, api_key):
+        body = response["response"]["body"]
+        if self.type == "base":
+            completion = openai.types.Completion.model_validate(body)
+        elif self.type == "chat":
+            completion = openai.types.chat.ChatCompletion.model_validate(body)
+
+        return self.process_result(completion=completion, api_key=api_key)
+
+    def create_client(self, api_key):
+        # The underlying httpx client keeps a keep-alive connection pool. The SDK's own retries are
+        # disabled so that 429s reach the key pool and retry_with_exponential_backoff
+        timeout = openai.Timeout(self.timeouts.get("read"), connect=self.timeouts.get("connect"))
+        client = OpenAI(api_key=api_key, max_retries=0, timeout=timeout)
+
+        return client
+
+    def get_total_tokens(self, completion):
+        if isinstance(completion, StreamedCompletion):
+            return completion.get_usage().get("total_tokens")
+        return completion.usage.total_tokens if completion.usage else None
+
+    def process_result(self, **kwargs):
+        completion = kwargs.get("completion")
+        if isinstance(completion, StreamedCompletion):
+            return self.process_streamed_result(**kwargs)
+
+        if self.type == "base":
+            return {
+                "model_name": completion.model,
+                "model_display_name": self.model_display_name,
+                "masked_api_key": kwargs["api_key"][-5:],
+                "result": completion.choices[0].text,
+                "candidates": [choice.text for choice in completion.choices],
+                "info": {
+                    'id': completion.id,
+                    'object': completion.object,
+                    'created': completion.created,
+                    'usage': {
+                        'completion_tokens': completion.usage.completion_tokens,
+                        'prompt_tokens': completion.usage.prompt_tokens,
+                        'total_tokens': completion.usage.total_tokens
+                    },
+                    'choices': [
+                        json.loads(choice.model_dump_json())
+                        for choice in completion.choices
+                    ]
+                }
+            }
+        elif self.type == "chat":
+            return {
+                "model_name": completion.model,
+                "model_display_name": self.model_display_name,
+                "masked_api_key": kwargs["api_key"][-5:],
+                "result": completion.choices[0].message.content,
+                "candidates": [choice.message.content for choice in completion.choices],
+                "info": {
+                    'id': completion.id,
+                    'object': completion.object,
+                    'created': completion.created,
+                    'system_fingerprint': completion.system_fingerprint,
+                    'usage': {
+                        'completion_tokens': completion.usage.completion_tokens,
+                        'prompt_tokens': completion.usage.prompt_tokens,
+                        'total_tokens': completion.usage.total_tokens
+                    },
+                    'choices': [
+                        json.loads(choice.model_dump_json())
+                        for choice in completion.choices
+                    ]
+                }
+            }
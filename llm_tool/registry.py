@@ -0,0 +1,30 @@
+import importlib
+
+
+# Model display name -> (module, class). A provider module, and the SDK it needs, is only imported when one of its
+# models is first used
+MODEL_REGISTRY = {
+    "palm2": ("llm_tool.google_model", "PaLM2Model"),
+    "gemini-pro": ("llm_tool.google_model", "GeminiModel"),
+    "gpt-3.5-1106": ("llm_tool.openai_model", "OpenAIModel"),
+    "Llama-2-7b-chat": ("llm_tool.azure_model", "LlamaModel"),
+    "Llama-2-13b-chat": ("llm_tool.azure_model", "LlamaModel"),
+    "Llama-2-70b-chat": ("llm_tool.azure_model", "LlamaModel"),
+    "qwen2.5-0.5b-local": ("llm_tool.local_model", "LocalLogprobModel"),
+}
+
+
+def register_model(model_name, module_name, class_name):
+    MODEL_REGISTRY[model_name] = (module_name, class_name)
+
+
+def get_model_class(model_name):
+    if model_name not in MODEL_REGISTRY:
+        raise RuntimeError('Model not supported')
+
+    module_name, class_name = MODEL_REGISTRY[model_name]
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def create_model(model_name):
+    return get_model_class(model_name)(model_name=model_name)
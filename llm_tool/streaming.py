@@ -0,0 +1,114 @@
+import json
+import re
+
+
+VERDICT_PATTERN = re.compile(r'\[\[([^\]]+)\]\]')
+
+
+class VerdictStreamParser:
+    """Incremental [[X]] detection over streamed text, so that the stream can be closed as soon as the verdict is complete.
+
+    The first complete verdict is the same one extract_llm_result finds in the full text. Stop sequences end the text
+    where they start, as the APIs do.
+    """
+
+    def __init__(self, stop_sequences=None):
+        self.text = ""
+        self.stop_sequences = stop_sequences or []
+        self.scan_from = 0
+        self.verdict = None
+        self.stop_sequence = None
+
+    def feed(self, chunk):
+        self.text += chunk
+
+        for stop_sequence in self.stop_sequences:
+            index = self.text.find(stop_sequence, max(0, len(self.text) - len(chunk) - len(stop_sequence)))
+            if index != -1:
+                self.text = self.text[:index]
+                self.stop_sequence = stop_sequence
+                return True
+
+        match = VERDICT_PATTERN.search(self.text, self.scan_from)
+        if match is not None:
+            self.verdict = match.group(1)
+            return True
+
+        # A verdict still to be completed cannot contain a "]", so it starts at most one character before the last one
+        # (a "]" at the very end may be the first half of the closing brackets)
+        last_bracket = self.text.rfind("]", 0, len(self.text) - 1)
+        self.scan_from = max(self.scan_from, last_bracket - 1)
+
+        return False
+
+
+class StreamedCompletion:
+    """A completion assembled from a stream, possibly closed early once the verdict was complete."""
+
+    def __init__(self, model=None):
+        self.id = None
+        self.created = None
+        self.model = model
+        self.system_fingerprint = None
+        self.text = ""
+        self.finish_reason = None
+        self.usage = None
+        self.num_chunks = 0
+        self.cancelled = False
+
+    def get_usage(self):
+        # A stream closed early never receives the usage, each content chunk is about one token
+        if self.usage is not None:
+            return self.usage
+        return {"completion_tokens": self.num_chunks, "prompt_tokens": None, "total_tokens": None, "estimated": True}
+
+    def to_info(self):
+        return {
+            'id': self.id,
+            'object': 'chat.completion.chunk',
+            'created': self.created,
+            'system_fingerprint': self.system_fingerprint,
+            'usage': self.get_usage(),
+            'finish_reason': self.finish_reason,
+            'cancelled': self.cancelled,
+        }
+
+
+def iter_sse_chunks(lines):
+    # Server-sent events of an OpenAI-style stream: "data: {...}" lines, ended by "data: [DONE]"
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        if not line.startswith("data:"):
+            continue
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            return
+        yield json.loads(data)
+
+
+def read_chat_stream(chunks, stop_sequences=None):
+    """Assemble OpenAI-format chat completion chunks, stopping at the first [[X]] verdict. The caller closes the stream."""
+    parser = VerdictStreamParser(stop_sequences)
+    completion = StreamedCompletion()
+    for chunk in chunks:
+        completion.id = completion.id or chunk.get("id")
+        completion.created = completion.created or chunk.get("created")
+        completion.model = completion.model or chunk.get("model")
+        completion.system_fingerprint = completion.system_fingerprint or chunk.get("system_fingerprint")
+        if chunk.get("usage"):
+            completion.usage = chunk["usage"]
+
+        for choice in chunk.get("choices") or []:
+            completion.finish_reason = choice.get("finish_reason") or completion.finish_reason
+            content = (choice.get("delta") or {}).get("content")
+            if content:
+                completion.num_chunks += 1
+                if parser.feed(content):
+                    completion.cancelled = True
+                    break
+        if completion.cancelled:
+            break
+
+    completion.text = parser.text
+    return completion
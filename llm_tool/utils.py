@@ -1,14 +1,25 @@
+import random
 import time
 from colorama import Fore, Style
 
-import openai
-import google.api_core.exceptions
+from .metrics import METRICS
+
+
+# Errors worth retrying, registered by each provider module when it is imported so that no SDK is loaded up front
+RETRYABLE_ERRORS = []
+
+
+def register_retryable_errors(*errors):
+    for error in errors:
+        if error not in RETRYABLE_ERRORS:
+            RETRYABLE_ERRORS.append(error)
 
 
 class AzureRateLimitError(Exception):
-    def __init__(self, message="Azure API rate limit exceeded."):
+    def __init__(self, message="Azure API rate limit exceeded.", retry_after=None):
         super().__init__(message)
         self.message = message
+        self.retry_after = retry_after
 
     def __str__(self):
         return self.message
@@ -23,18 +34,28 @@ class AzureServerError(Exception):
         return self.message
 
 
+def get_retry_after(error):
+    # Seconds asked for by the Retry-After header of an HTTP error or response, if any
+    retry_after = getattr(error, "retry_after", None)
+    if retry_after is None:
+        response = getattr(error, "response", error)
+        headers = getattr(response, "headers", None) or {}
+        retry_after = headers.get("retry-after")
+
+    try:
+        return float(retry_after) if retry_after is not None else None
+    except ValueError:
+        return None
+
+
 def retry_with_exponential_backoff(
     func,
     initial_delay: float = 1,
     exponential_base: float = 2,
     max_retries: int = 10,
-    errors: tuple = (
-        AzureRateLimitError, AzureServerError,
-        openai.RateLimitError, openai.APIError,
-        google.api_core.exceptions.ResourceExhausted, google.api_core.exceptions.ServiceUnavailable, google.api_core.exceptions.GoogleAPIError,
-    ),
+    errors: tuple = None,
 ):
-    """Retry a function with exponential backoff."""
+    """Retry a function with exponential backoff, on errors or else on every registered retryable error."""
 
     def wrapper(*args, **kwargs):
         # Initialize variables
@@ -45,9 +66,10 @@ def retry_with_exponential_backoff(
             try:
                 return func(*args, **kwargs)
             # Retry on specific errors
-            except errors as e:
+            except (errors or tuple(RETRYABLE_ERRORS)) as e:
                 # Increment retries
                 num_retries += 1
+                METRICS.inc("llm_retries_total", error=type(e).__name__)
                 # Check if max retries has been reached
                 if num_retries > max_retries:
                     raise Exception(
@@ -55,9 +77,13 @@ def retry_with_exponential_backoff(
                     )
                 # Increment the delay
                 delay *= exponential_base
+                # Honor Retry-After when the server sends it, and add jitter so that threads do not retry in lockstep
+                sleep_time = get_retry_after(e) or delay
+                sleep_time *= 1 + random.random() * 0.5
+                METRICS.inc("llm_retry_sleep_seconds_total", sleep_time)
                 # Sleep for the delay
-                print(Fore.YELLOW + f"Error encountered. Retry ({num_retries}) after {delay} seconds..." + Style.RESET_ALL)
-                time.sleep(delay)
+                print(Fore.YELLOW + f"Error encountered. Retry ({num_retries}) after {sleep_time:.1f} seconds..." + Style.RESET_ALL)
+                time.sleep(sleep_time)
             # Raise exceptions for any errors not specified
             except Exception as e:
                 raise e
@@ -1,29 +1,69 @@
 import itertools
 
-from utils.data import get_tasks, preprocess_question, preprocess_choices, process_ground_truth
+from utils.common import parse_args
+from utils.data import get_tasks
 from utils.experiment import experiment_per_doc, get_model
+from utils.runner import run_experiments, run_experiments_batch
+from utils.storage import get_result_store
+from llm_tool.cache import get_response_cache
+from llm_tool.batch import OpenAIBatchTransport
+from llm_tool.metrics import METRICS, MetricsExporter
 
 
 if __name__ == "__main__":
+    args = parse_args()
     tasks, is_validation = get_tasks()
-    for task in tasks:
-        for doc_id, doc in enumerate(itertools.islice(task["task_docs"], 0, None)):
-            doc = preprocess_question(task["task"], doc)
-            doc = preprocess_choices(task["task"], doc)
-            doc = process_ground_truth(task["task"], doc)
+    result_store = get_result_store(args.result_store)
 
-            model = get_model(task['args'].model)
+    base_config = {
+        'prompt_types': args.prompt_type,
+        'choice_symbols': args.choice_symbol,
+        'validation': is_validation,
+        'simplify': True,
+        'permutation_mode': args.permutation_mode,
+        'num_sampled_permutations': args.num_sampled_permutations,
+        'adaptive_tolerance': args.adaptive_tolerance,
+        'adaptive_min_permutations': args.adaptive_min_permutations,
+        'temperature': 0,
+        'candidate_count': 1,
+        'use_cache': not args.no_cache,
+        'hedge_quantile': args.hedge_quantile,
+        'stream': args.stream,
+        'stop_sequences': args.stop_sequences,
+        'result_store': result_store
+    }
 
-            experiment_config = {
-                'task_name': task["task"],
-                'model': model,
-                'doc_id': doc_id,
-                'doc': doc,
-                'prompt_type': 'general_instruction',
-                'choice_symbol': task['args'].choice_symbol,
-                'validation': is_validation,
-                'simplify': True,
-                'temperature': 0,
-                'candidate_count': 1
-            }
-            experiment_per_doc(**experiment_config)
+    if args.metrics_file:
+        metrics_exporter = MetricsExporter(METRICS, args.metrics_file, args.metrics_interval)
+        metrics_exporter.start()
+
+    try:
+        if args.plan:
+            # Only a plan needs the tokenizer
+            from utils.planner import plan_experiments
+            plan_experiments(tasks, base_config, args.plan_output_tokens)
+        elif args.batch:
+            run_experiments_batch(tasks, base_config, OpenAIBatchTransport(base_url=args.batch_base_url))
+        elif args.async_run:
+            run_experiments(tasks, base_config, args.concurrency)
+        else:
+            for task in tasks:
+                models = [get_model(model_name) for model_name in task['args'].model]
+                for doc_id, doc in enumerate(itertools.islice(task["task_docs"], 0, None)):
+                    experiment_config = {
+                        'task_name': task["task"],
+                        'models': models,
+                        'doc_id': doc_id,
+                        'doc': doc,
+                        **base_config
+                    }
+                    experiment_per_doc(**experiment_config)
+    finally:
+        result_store.close()
+        if not args.no_cache:
+            get_response_cache().flush()
+        if args.metrics_file:
+            metrics_exporter.stop()
+
+    if not args.no_cache:
+        print(f'LLM response cache: {get_response_cache().stats()}')
@@ -0,0 +1,7 @@
+from utils.common import parse_rescore_args
+from utils.rescore import rescore_results
+
+
+if __name__ == "__main__":
+    args = parse_rescore_args()
+    rescore_results(args.result_store, args.num_workers, args.dry_run)
@@ -0,0 +1,226 @@
+import csv
+
+import numpy as np
+
+from utils.common import ANALYSIS_DIR, category_subcategory_mapping
+from utils.permutation import nth_permutation, get_permutation_ids, sample_permutation_ids
+from utils.storage import get_result_store
+
+
+SHARD_FIELDS = ['model', 'prompt_type', 'task', 'choice_symbol', 'temperature']
+
+
+def get_symbol_index(symbol):
+    return ord(symbol) - ord('A') if isinstance(symbol, str) and len(symbol) == 1 else -1
+
+
+# Designs whose permutations are the same for every doc, so records can be matched to them by permutation_id
+DETERMINISTIC_DESIGNS = ['simplify', 'all', 'cyclic', 'latin_square']
+
+
+def get_num_sampled_permutations(result_store, shard):
+    # The sample size of each doc's sampled run, recorded with its results
+    return {
+        record['doc_id']: record['num_sampled_permutations']
+        for record in result_store.iter_records(shard)
+        if record.get('permutation_design') == 'sampled' and record.get('num_sampled_permutations') is not None
+    }
+
+
+def is_in_design(record, permutation_design, design_ids, num_sampled_permutations=None):
+    # A permutation shared by several designs is only run, and recorded, by the first of them, so designs are matched by
+    # permutation_id. Sampled ids are drawn again from the doc's seed, only the adaptive ones depend on the answers and
+    # are matched by the design recorded with the result
+    if permutation_design is None:
+        return True
+
+    num_choices = len(record['permutation'])
+    if permutation_design in DETERMINISTIC_DESIGNS:
+        key = num_choices
+        if key not in design_ids:
+            design_ids[key] = set(get_permutation_ids(num_choices, permutation_design))
+    elif permutation_design == 'sampled' and record['doc_id'] in (num_sampled_permutations or {}):
+        num_sampled = num_sampled_permutations[record['doc_id']]
+        key = (record['task'], record['doc_id'], num_sampled)
+        if key not in design_ids:
+            design_ids[key] = set(sample_permutation_ids(num_choices, num_sampled, seed=f'{record["task"]}/{record["doc_id"]}'))
+    else:
+        return record.get('permutation_design') == permutation_design
+
+    return record['permutation_id'] in design_ids[key]
+
+
+def load_records(result_store_names=('directory', 'jsonl'), permutation_design=None):
+    shards = []
+    columns = {
+        'shard': [],
+        'doc_id': [],
+        'permutation_id': [],
+        'num_choices': [],
+        'ground_truth_index': [],
+        'answer_index': [],
+        'answer_symbol_index': [],
+        'ground_truth_symbol_index': [],
+        'answer_original_index': [],
+    }
+    # Original choice index at each position, per (num_choices, permutation_id)
+    original_indices = dict()
+    design_ids = dict()
+
+    for result_store_name in result_store_names:
+        result_store = get_result_store(result_store_name)
+        for shard in result_store.iter_shards():
+            shard_id = len(shards)
+            shards.append(shard)
+            num_sampled_permutations = None
+            if permutation_design == 'sampled':
+                num_sampled_permutations = get_num_sampled_permutations(result_store, shard)
+            for record in result_store.iter_records(shard):
+                if not is_in_design(record, permutation_design, design_ids, num_sampled_permutations):
+                    continue
+                num_choices = len(record['permutation'])
+                answer_index = record['answer_index'] if record['answer_index'] is not None else -1
+                position_symbols = {index: symbol for symbol, index in record['symbol_mapping'].items()}
+
+                key = (num_choices, record['permutation_id'])
+                if key not in original_indices:
+                    original_indices[key] = nth_permutation(range(num_choices), record['permutation_id'])
+
+                columns['shard'].append(shard_id)
+                columns['doc_id'].append(record['doc_id'])
+                columns['permutation_id'].append(record['permutation_id'])
+                columns['num_choices'].append(num_choices)
+                columns['ground_truth_index'].append(record['ground_truth_index'])
+                columns['answer_index'].append(answer_index)
+                columns['answer_symbol_index'].append(get_symbol_index(position_symbols.get(answer_index)))
+                columns['ground_truth_symbol_index'].append(get_symbol_index(position_symbols.get(record['ground_truth_index'])))
+                columns['answer_original_index'].append(original_indices[key][answer_index] if answer_index >= 0 else -1)
+
+    records = {name: np.array(values, dtype=np.int64) for name, values in columns.items()}
+    records['shards'] = shards
+
+    return records
+
+
+def get_distribution(groups, values, num_groups, num_values, mask=None):
+    if mask is not None:
+        groups, values = groups[mask], values[mask]
+    counts = np.bincount(groups * num_values + values, minlength=num_groups * num_values).reshape(num_groups, num_values)
+
+    return counts / np.maximum(counts.sum(axis=1, keepdims=True), 1)
+
+
+def compute_metrics(records, groups, num_groups):
+    # Records with a negative group are left out of the table
+    mask = groups >= 0
+    groups = groups[mask]
+    records = {name: values[mask] for name, values in records.items() if name != 'shards'}
+
+    num_positions = int(records['num_choices'].max()) if len(groups) else 1
+    num_records = np.bincount(groups, minlength=num_groups)
+    safe_num_records = np.maximum(num_records, 1)
+    answered = records['answer_index'] >= 0
+
+    accuracy = np.bincount(groups, weights=records['answer_index'] == records['ground_truth_index'], minlength=num_groups) / safe_num_records
+    invalid_rate = np.bincount(groups, weights=~answered, minlength=num_groups) / safe_num_records
+
+    # Bias as the total variation distance between where the answers land and where the ground truth is
+    answer_positions = get_distribution(groups, records['answer_index'], num_groups, num_positions, answered)
+    ground_truth_positions = get_distribution(groups, records['ground_truth_index'], num_groups, num_positions)
+    position_bias = 0.5 * np.abs(answer_positions - ground_truth_positions).sum(axis=1)
+
+    symbol_answered = answered & (records['answer_symbol_index'] >= 0) & (records['answer_symbol_index'] < num_positions)
+    symbol_known = (records['ground_truth_symbol_index'] >= 0) & (records['ground_truth_symbol_index'] < num_positions)
+    answer_symbols = get_distribution(groups, records['answer_symbol_index'], num_groups, num_positions, symbol_answered)
+    ground_truth_symbols = get_distribution(groups, records['ground_truth_symbol_index'], num_groups, num_positions, symbol_known)
+    symbol_bias = 0.5 * np.abs(answer_symbols - ground_truth_symbols).sum(axis=1)
+
+    # A doc is consistent when every evaluated permutation picked the same original choice. doc_ids are only unique within
+    # a shard, and every shard falls in a single group, so docs are keyed on (shard, doc_id) and take their shard's group
+    doc_keys = records['shard'] * (int(records['doc_id'].max()) + 1 if len(groups) else 1) + records['doc_id']
+    order = np.argsort(doc_keys, kind='stable')
+    sorted_keys = doc_keys[order]
+    sorted_answers = records['answer_original_index'][order]
+    starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]]) if len(groups) else np.array([], dtype=np.int64)
+    doc_groups = groups[order][starts]
+    multi_permutation = np.diff(np.r_[starts, len(sorted_keys)]) > 1
+    consistent = np.minimum.reduceat(sorted_answers, starts) == np.maximum.reduceat(sorted_answers, starts) if len(starts) else np.array([], dtype=bool)
+
+    num_docs = np.bincount(doc_groups, minlength=num_groups)
+    num_multi_permutation_docs = np.bincount(doc_groups, weights=multi_permutation, minlength=num_groups)
+    consistency = np.bincount(doc_groups, weights=consistent & multi_permutation, minlength=num_groups) / np.maximum(num_multi_permutation_docs, 1)
+
+    metrics = {
+        'num_records': num_records,
+        'num_docs': num_docs,
+        'accuracy': accuracy,
+        'invalid_rate': invalid_rate,
+        'position_bias': position_bias,
+        'symbol_bias': symbol_bias,
+        'consistency': consistency,
+    }
+    for position in range(num_positions):
+        metrics[f'answer_position_{position}'] = answer_positions[:, position]
+    for position in range(num_positions):
+        metrics[f'answer_symbol_{chr(ord("A") + position)}'] = answer_symbols[:, position]
+
+    return metrics
+
+
+def get_split(task_dir_name):
+    # Validation shards are stored under <task>_val
+    return 'validation' if task_dir_name.endswith('_val') else 'test'
+
+
+def get_category(task_dir_name):
+    task_name = task_dir_name.removesuffix('_val')
+    if not task_name.startswith('mmlu_'):
+        return None
+
+    return category_subcategory_mapping.get(task_name.removeprefix('mmlu_'))
+
+
+def write_table(path, labels, label_fields, metrics):
+    with path.open('w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(label_fields + list(metrics.keys()))
+        for group_id, label in enumerate(labels):
+            if metrics['num_records'][group_id] == 0:
+                continue
+            writer.writerow(list(label) + [
+                round(float(values[group_id]), 6) if values.dtype.kind == 'f' else int(values[group_id])
+                for values in metrics.values()
+            ])
+    print(f'Wrote {path}')
+
+
+def run_analysis(result_store_names=('directory', 'jsonl'), permutation_design=None, output_dir=ANALYSIS_DIR):
+    records = load_records(result_store_names, permutation_design)
+    shards = records['shards']
+    print(f'Loaded {len(records["shard"])} records from {len(shards)} shards')
+
+    # By task: every shard is one row
+    output_dir.mkdir(exist_ok=True, parents=True)
+    metrics = compute_metrics(records, records['shard'], len(shards))
+    write_table(output_dir / 'metrics_by_task.csv', shards, SHARD_FIELDS, metrics)
+
+    # By MMLU category: shards are merged into (model, prompt_type, category, split, choice_symbol, temperature), the
+    # validation and test splits of a task are never pooled
+    category_labels = []
+    category_ids = dict()
+    shard_categories = []
+    for shard in shards:
+        category = get_category(shard[2])
+        if category is None:
+            shard_categories.append(-1)
+            continue
+        label = (shard[0], shard[1], category, get_split(shard[2]), shard[3], shard[4])
+        if label not in category_ids:
+            category_ids[label] = len(category_labels)
+            category_labels.append(label)
+        shard_categories.append(category_ids[label])
+
+    shard_categories = np.array(shard_categories, dtype=np.int64)
+    groups = shard_categories[records['shard']] if len(shards) else records['shard']
+    metrics = compute_metrics(records, groups, len(category_labels))
+    write_table(output_dir / 'metrics_by_category.csv', category_labels, ['model', 'prompt_type', 'category', 'split', 'choice_symbol', 'temperature'], metrics)
@@ -4,12 +4,12 @@ from pathlib import Path
 from llm_tool.config import MODEL_NAME_MAPPING
 
 
+# Directories are created by whatever writes to them, importing this module has no side effects
 ARTIFACTS_DIR = Path('artifacts')
-ARTIFACTS_DIR.mkdir(exist_ok=True, parents=True)
 RESULTS_DIR = Path("results")
-RESULTS_DIR.mkdir(exist_ok=True, parents=True)
 ANALYSIS_DIR = ARTIFACTS_DIR / 'RQ1' / 'analysis'
-ANALYSIS_DIR.mkdir(exist_ok=True, parents=True)
+BATCH_DIR = ARTIFACTS_DIR / 'batches'
+DOC_CACHE_DIR = ARTIFACTS_DIR / 'doc_cache'
 
 
 def parse_args():
@@ -18,14 +18,114 @@ def parse_args():
         "--tasks", default=None
     )
     parser.add_argument(
-        "--model", default='palm2', type=str, choices=list(MODEL_NAME_MAPPING.keys())
+        "--model", default=['palm2'], type=str, nargs='+', choices=list(MODEL_NAME_MAPPING.keys()),
+        help="one or more models, every prompt is built once and sent to all of them"
     )
     parser.add_argument(
-        "--choice_symbol", default='original', type=str, choices=['original', 'reversed']
+        "--choice_symbol", default=['original'], type=str, nargs='+', choices=['original', 'reversed'],
+        help="one or more symbol modes, all of them are run in a single pass over the docs"
+    )
+    parser.add_argument(
+        "--prompt_type", default=['general_instruction'], type=str, nargs='+', choices=['general_instruction', 'symbol_only'],
+        help="symbol_only asks for the bare symbol, decoded in at most 3 tokens and read from the logprobs where available"
     )
     parser.add_argument(
         "--get_val", default=False, type=bool, choices=[True, False]
     )
+    parser.add_argument(
+        "--async_run", action="store_true"
+    )
+    parser.add_argument(
+        "--concurrency", default=None, type=int,
+        help="in-flight requests per provider for --async_run, overrides MAX_CONCURRENCY"
+    )
+    parser.add_argument(
+        "--batch", action="store_true", help="send OpenAI requests through the Batch API instead of one at a time"
+    )
+    parser.add_argument(
+        "--batch_base_url", default=None, type=str, help="base URL of a stand-in Batch API server for testing"
+    )
+    parser.add_argument(
+        "--plan", action="store_true", help="build every pending prompt and report calls, tokens, cost and time without sending them"
+    )
+    parser.add_argument(
+        "--plan_output_tokens", default=200, type=int, help="expected output tokens per call for --plan"
+    )
+    parser.add_argument(
+        "--metrics_file", default=None, type=str,
+        help="periodically export run metrics to this file, Prometheus text format for *.prom and JSON otherwise"
+    )
+    parser.add_argument(
+        "--metrics_interval", default=15, type=float, help="seconds between metrics exports"
+    )
+    parser.add_argument(
+        "--no_cache", action="store_true", help="bypass the local LLM response cache"
+    )
+    parser.add_argument(
+        "--stream", action="store_true",
+        help="stream OpenAI, Gemini and Llama answers and close the stream as soon as the [[X]] verdict is complete"
+    )
+    parser.add_argument(
+        "--stop_sequences", default=None, type=str, nargs='+',
+        help="sequences that end generation, as a fallback for answers that run on after the verdict"
+    )
+    parser.add_argument(
+        "--hedge_quantile", default=None, type=float,
+        help="send a duplicate of requests slower than this quantile of recent latencies (e.g. 0.95), first answer wins"
+    )
+    parser.add_argument(
+        "--permutation_mode", default='simplify', type=str, choices=['simplify', 'all', 'sampled', 'adaptive', 'cyclic', 'latin_square'],
+        help="cyclic and latin_square evaluate n balanced orders per doc, with every choice in every position once"
+    )
+    parser.add_argument(
+        "--num_sampled_permutations", default=24, type=int,
+        help="permutations evaluated per doc with --permutation_mode sampled, the identity is always included, "
+             "and the most drawn per doc with --permutation_mode adaptive"
+    )
+    parser.add_argument(
+        "--adaptive_tolerance", default=0.1, type=float,
+        help="with --permutation_mode adaptive, stop once the standard error of every answer frequency is at most this"
+    )
+    parser.add_argument(
+        "--adaptive_min_permutations", default=4, type=int,
+        help="permutations drawn per doc before --permutation_mode adaptive may stop"
+    )
+    parser.add_argument(
+        "--result_store", default='directory', type=str, choices=['directory', 'jsonl']
+    )
+    parser.add_argument(
+        "--no_doc_cache", action="store_true",
+        help="load every task through lm_eval instead of the cache of normalized docs in artifacts/doc_cache"
+    )
+
+    return parser.parse_args()
+
+
+def parse_analysis_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--result_store", default=['directory', 'jsonl'], nargs='+', choices=['directory', 'jsonl']
+    )
+    parser.add_argument(
+        "--permutation_design", default=None, type=str,
+        choices=['simplify', 'all', 'sampled', 'adaptive', 'cyclic', 'latin_square'],
+        help="only analyze the permutations of this design, by default every record is used"
+    )
+
+    return parser.parse_args()
+
+
+def parse_rescore_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--result_store", default=['directory', 'jsonl'], nargs='+', choices=['directory', 'jsonl']
+    )
+    parser.add_argument(
+        "--num_workers", default=None, type=int, help="worker processes, defaults to the number of CPUs"
+    )
+    parser.add_argument(
+        "--dry_run", action="store_true", help="only report how many records would change"
+    )
 
     return parser.parse_args()
 
@@ -1,42 +1,78 @@
+import fnmatch
+import hashlib
+import inspect
 import json
+import math
 import re
 
 from utils.common import parse_args, ARTIFACTS_DIR
-from lm_eval import tasks, utils
+from utils.doc_cache import DocCache, DOC_FIELDS
 
 
-def update_task_info(task_name, count):
+def update_task_info(doc_counts):
     output_path = ARTIFACTS_DIR / 'task_info.json'
     if output_path.exists():
         task_info = json.loads(output_path.read_text())
     else:
         task_info = dict()
 
-    if task_name in task_info:
+    new_task_info = {
+        task_name: count
+        for task_name, count in doc_counts.items()
+        if task_name not in task_info
+    }
+    if not new_task_info:
         return
 
-    task_info[task_name] = count
+    task_info.update(new_task_info)
+    output_path.parent.mkdir(exist_ok=True, parents=True)
     output_path.write_text(json.dumps(task_info, indent=4))
 
 
-def get_tasks():
-    args = parse_args()
-    task_manager = tasks.TaskManager()
-    if args.tasks is None:
-        task_names = task_manager.all_tasks
+def iter_task_docs(task_name, task_doc_func, doc_counts):
+    task_docs = task_doc_func()
+    if hasattr(task_docs, '__len__'):
+        doc_counts[task_name] = len(task_docs)
+        yield from task_docs
     else:
-        task_names = utils.pattern_match(args.tasks.split(','), task_manager.all_tasks)
-    print(f'Tasks: {task_names}')
-    task_dict = tasks.get_task_dict(task_names)
+        count = 0
+        for doc in task_docs:
+            count += 1
+            yield doc
+        doc_counts[task_name] = count
+
+
+def normalize_doc(task_name, doc):
+    doc = preprocess_question(task_name, doc)
+    doc = preprocess_choices(task_name, doc)
+    doc = process_ground_truth(task_name, doc)
+
+    return {field: doc[field] for field in DOC_FIELDS}
+
+
+def get_normalization_version():
+    # Hash of the code that normalizes docs, so that the doc cache is rebuilt whenever it changes
+    source = ''.join(
+        inspect.getsource(func)
+        for func in [normalize_doc, preprocess_question, preprocess_choices, process_ground_truth]
+    )
+    return hashlib.sha256(source.encode('utf-8')).hexdigest()[:12]
+
+
+def get_task_manager():
+    # lm_eval is only imported when a task is missing from the doc cache
+    from lm_eval import tasks
 
-    task_dict_items = [
-        (name, task)
-        for name, task in task_dict.items()
-        if task.has_validation_docs() or task.has_test_docs()
-    ]
+    return tasks.TaskManager()
 
-    target_tasks = []
-    for task_name, task in task_dict_items:
+
+def iter_lm_eval_tasks(task_manager, name, args):
+    from lm_eval import tasks
+
+    task_dict = tasks.get_task_dict([name], task_manager)
+    for task_name, task in task_dict.items():
+        if not (task.has_validation_docs() or task.has_test_docs()):
+            continue
 
         if args.get_val:
             if task_name in ['hellaswag', 'winogrande']:
@@ -53,16 +89,93 @@ def get_tasks():
             else:
                 raise RuntimeError('Task has neither test_docs nor validation_docs')
 
-        task_docs = list(task_doc_func())
-        update_task_info(task_name, len(task_docs))
+        yield task_name, task_doc_func
+
+
+def iter_target_tasks(task_names, args, doc_cache=None):
+    # Tasks are loaded one at a time, so only the task being run is held in memory.
+    # Docs come out normalized (this_question, this_choices, ground_truth), from the doc cache when it has them
+    split = 'validation' if args.get_val else 'evaluation'
+    task_manager = None
+    doc_counts = dict()
+    # A group and its subtasks can both be named (e.g. --tasks mmlu*), each task is only run once
+    seen = set()
+    try:
+        for name in task_names:
+            if name in seen:
+                continue
+
+            cached_task_names = doc_cache.get_group(name, split) if doc_cache is not None else None
+            if cached_task_names is not None:
+                for task_name in cached_task_names:
+                    if task_name in seen:
+                        continue
+                    seen.add(task_name)
+                    yield {
+                        'task': task_name,
+                        'task_docs': iter_task_docs(
+                            task_name, lambda task_name=task_name: doc_cache.iter_docs(task_name, split), doc_counts
+                        ),
+                        'args': args,
+                    }
+                continue
+
+            task_manager = task_manager or get_task_manager()
+            group = []
+            for task_name, task_doc_func in iter_lm_eval_tasks(task_manager, name, args):
+                group.append(task_name)
+                if task_name in seen:
+                    continue
+                seen.add(task_name)
+
+                task_docs = (
+                    normalize_doc(task_name, doc)
+                    for doc in iter_task_docs(task_name, task_doc_func, doc_counts)
+                )
+                if doc_cache is not None:
+                    task_docs = doc_cache.write_through(task_name, split, task_docs)
+
+                yield {
+                    'task': task_name,
+                    'task_docs': task_docs,
+                    'args': args,
+                }
+            if doc_cache is not None:
+                doc_cache.set_group(name, group)
+    finally:
+        update_task_info(doc_counts)
+
+
+def pattern_match(patterns, task_names):
+    # Same matching as lm_eval.utils.pattern_match
+    return sorted({
+        task_name
+        for pattern in patterns
+        for task_name in fnmatch.filter(task_names, pattern)
+    })
+
+
+def get_all_task_names(doc_cache=None):
+    task_names = doc_cache.get_task_index() if doc_cache is not None else None
+    if task_names is None:
+        task_names = get_task_manager().all_tasks
+        if doc_cache is not None:
+            doc_cache.set_task_index(task_names)
+
+    return task_names
+
 
-        target_tasks.append({
-            'task': task_name,
-            'task_docs': task_docs,
-            'args': args,
-        })
+def get_tasks():
+    args = parse_args()
+    doc_cache = None if args.no_doc_cache else DocCache(normalization_version=get_normalization_version())
+    all_task_names = get_all_task_names(doc_cache)
+    if args.tasks is None:
+        task_names = all_task_names
+    else:
+        task_names = pattern_match(args.tasks.split(','), all_task_names)
+    print(f'Tasks: {task_names}')
 
-    return target_tasks, args.get_val
+    return iter_target_tasks(task_names, args, doc_cache), args.get_val
 
 
 def preprocess_question(task_name, doc):
@@ -135,6 +248,8 @@ Please carefully read the following questions and choices. Select the most suita
 
     if prompt_type == 'general_instruction':
         prompt += 'Indicate your choice by placing it inside double square brackets, with a single character representing the chosen option. For example, [[<single_character>]].'
+    elif prompt_type == 'symbol_only':
+        prompt += 'Output only the single character representing the chosen option, without brackets, punctuation or explanation. For example, <single_character>.'
 
     return prompt
 
@@ -166,6 +281,13 @@ def get_choices_prompt(choices, choice_symbol):
     return prompt, symbol_mapping
 
 
+# Bracketed verdicts in one pass: each "[" is consumed alone and the rest is a lookahead, so a [X] can not hide an
+# overlapping [[X]], and [[X]] is tried first where both start
+BRACKET_VERDICT_PATTERN = re.compile(r'\[(?:(?=\[([^\]]+)\]\])|(?=([^\]]+)\]))')
+# A whole answer that is just the symbol, as asked for by the symbol_only prompt type
+BARE_SYMBOL_PATTERN = re.compile(r'\s*\(?([A-Za-z])\)?\.?\s*$')
+
+
 def extract_llm_result(s, lowercase=False):
     if s is None:
         return None
@@ -174,24 +296,73 @@ def extract_llm_result(s, lowercase=False):
     else:
         s_adjusted = s.upper()
 
-    double_pattern = re.compile(r'\[\[([^\]]+)\]\]')
-    double_matches = double_pattern.findall(s_adjusted)
+    # The first [[X]] wins anywhere in the text, the first [X] and a bare X are only fallbacks. The text is scanned
+    # once, the bare symbol is an anchored match that stops at the first character that does not fit
+    candidate = None
+    for match in BRACKET_VERDICT_PATTERN.finditer(s_adjusted):
+        if match.group(1) is not None:
+            candidate = match.group(1)
+            break
+        candidate = candidate or match.group(2)
+    if candidate is None:
+        match = BARE_SYMBOL_PATTERN.match(s_adjusted)
+        if match is None:
+            return None
+        candidate = match.group(1)
 
-    single_pattern = re.compile(r'\[([^\]]+)\]')
-    single_matches = single_pattern.findall(s_adjusted)
+    if len(candidate) == 1:
+        return candidate
+    else:
+        return candidate.lower()
 
-    try:
-        candidate = double_matches[0]
-        if len(candidate) == 1:
-            return candidate
-        else:
-            return candidate.lower()
-    except:
-        try:
-            candidate = single_matches[0]
-            if len(candidate) == 1:
-                return candidate
-            else:
-                return candidate.lower()
-        except:
-            return None
+
+def extract_answer(result, permutation, symbol_mapping, lowercase=False):
+    # Parse the main result, falling back to the other candidates when it has no verdict
+    answer_choice = extract_llm_result(result.get('result'), lowercase)
+    if answer_choice is None:
+        for candidate in result.get('candidates') or []:
+            if isinstance(candidate, str):
+                answer_choice = extract_llm_result(candidate, lowercase)
+                if answer_choice is not None:
+                    break
+
+    answer_index = symbol_mapping.get(answer_choice)
+    answer_text = permutation[answer_index] if answer_index is not None else ''
+
+    return answer_choice, answer_index, answer_text
+
+
+def get_top_logprobs(choice):
+    # Top logprobs of each generated token as [{token: logprob}], from a chat or a text completion choice
+    logprobs = choice.get('logprobs') or {}
+    if logprobs.get('content') is not None:
+        return [
+            {top['token']: top['logprob'] for top in token['top_logprobs']}
+            for token in logprobs['content']
+        ]
+
+    return logprobs.get('top_logprobs') or []
+
+
+def extract_symbol_distribution(result, symbols, lowercase=False):
+    # Probability of each choice symbol, renormalized over the symbols, at the first generated token that is one
+    info = result.get('info') or {}
+    if info.get('symbol_distribution') is not None:
+        return info['symbol_distribution']
+    if not info.get('choices'):
+        return None
+
+    for top_logprobs in get_top_logprobs(info['choices'][0]):
+        symbol_probs = dict.fromkeys(symbols, 0.0)
+        for token, logprob in top_logprobs.items():
+            token = token.strip().strip('[]().')
+            token = token if lowercase else token.upper()
+            if token in symbol_probs:
+                # " A" and "A" are different tokens for the same answer
+                symbol_probs[token] += math.exp(logprob)
+
+        total = sum(symbol_probs.values())
+        if total > 0:
+            return {symbol: prob / total for symbol, prob in symbol_probs.items()}
+
+    return None
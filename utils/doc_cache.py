@@ -0,0 +1,99 @@
+import json
+import mmap
+import os
+from array import array
+from importlib.metadata import version, PackageNotFoundError
+
+from utils.common import DOC_CACHE_DIR
+
+
+# Fields left by preprocess_question, preprocess_choices and process_ground_truth, the only ones the experiments read
+DOC_FIELDS = ['this_question', 'this_choices', 'ground_truth']
+
+
+def get_lm_eval_version():
+    # Read from the package metadata, which does not import lm_eval
+    try:
+        return version('lm_eval')
+    except PackageNotFoundError:
+        return 'unknown'
+
+
+class DocCache:
+    """Normalized docs of each task and split, so that later runs need neither lm_eval nor the datasets.
+
+    Each task and split is a file of concatenated JSON records and an array of their byte offsets, read through mmap.
+    The manifest holds the lm_eval task index and the tasks each --tasks name expands to. Entries are per lm_eval version
+    and per normalization_version, which changes with the code that normalizes the docs.
+    """
+
+    def __init__(self, cache_dir=DOC_CACHE_DIR, normalization_version='default'):
+        self.cache_dir = cache_dir / get_lm_eval_version() / normalization_version
+        self.manifest_path = self.cache_dir / 'manifest.json'
+        if self.manifest_path.exists():
+            self.manifest = json.loads(self.manifest_path.read_text())
+        else:
+            self.manifest = {'task_index': None, 'groups': dict()}
+
+    def save_manifest(self):
+        self.cache_dir.mkdir(exist_ok=True, parents=True)
+        tmp_path = self.manifest_path.with_suffix('.tmp')
+        tmp_path.write_text(json.dumps(self.manifest, indent=4))
+        os.replace(tmp_path, self.manifest_path)
+
+    def get_task_index(self):
+        return self.manifest['task_index']
+
+    def set_task_index(self, task_names):
+        self.manifest['task_index'] = list(task_names)
+        self.save_manifest()
+
+    def get_group(self, name, split):
+        # The tasks a name expanded to, when every one of them is cached
+        task_names = self.manifest['groups'].get(name)
+        if task_names is None or not all(self.contains(task_name, split) for task_name in task_names):
+            return None
+
+        return task_names
+
+    def set_group(self, name, task_names):
+        self.manifest['groups'][name] = list(task_names)
+        self.save_manifest()
+
+    def get_paths(self, task_name, split):
+        task_dir = self.cache_dir / task_name
+        return task_dir / f'{split}.docs', task_dir / f'{split}.offsets'
+
+    def contains(self, task_name, split):
+        # The offsets are written last, so they only exist for a complete entry
+        return self.get_paths(task_name, split)[1].exists()
+
+    def iter_docs(self, task_name, split):
+        docs_path, offsets_path = self.get_paths(task_name, split)
+        offsets = array('Q')
+        offsets.frombytes(offsets_path.read_bytes())
+        if len(offsets) < 2:
+            return
+
+        with docs_path.open('rb') as docs_file, mmap.mmap(docs_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for start, end in zip(offsets, offsets[1:]):
+                yield json.loads(data[start:end])
+
+    def write_through(self, task_name, split, docs):
+        # Docs are passed on as they are written, the entry is only committed once the task has been read to the end
+        docs_path, offsets_path = self.get_paths(task_name, split)
+        docs_path.parent.mkdir(exist_ok=True, parents=True)
+        tmp_docs_path = docs_path.with_suffix('.docs.tmp')
+
+        offsets = array('Q', [0])
+        with tmp_docs_path.open('wb') as docs_file:
+            for doc in docs:
+                record = json.dumps({field: doc[field] for field in DOC_FIELDS}, ensure_ascii=False).encode('utf-8')
+                docs_file.write(record)
+                offsets.append(offsets[-1] + len(record))
+                yield doc
+
+        os.replace(tmp_docs_path, docs_path)
+        tmp_offsets_path = offsets_path.with_suffix('.offsets.tmp')
+        tmp_offsets_path.write_bytes(offsets.tobytes())
+        os.replace(tmp_offsets_path, offsets_path)
@@ -1,100 +1,237 @@
-import itertools
-import json
+from llm_tool.registry import create_model
+from llm_tool.metrics import METRICS
 
-from llm_tool.model import PaLM2Model, GeminiModel, OpenAIModel, LlamaModel
+from utils.data import get_instruction_prompt, get_question_prompt, get_choices_prompt, extract_answer, \
+    extract_symbol_distribution
+from utils.storage import get_result_store, get_shard
+from utils.permutation import nth_permutation, get_permutation_ids, AdaptiveStoppingRule
 
-from utils.data import get_instruction_prompt, get_question_prompt, get_choices_prompt, extract_llm_result
-from utils.common import RESULTS_DIR
+
+def build_prompt(task_name, doc, permutation, prompt_type, choice_symbol):
+    instruction_prompt = get_instruction_prompt(permutation, prompt_type)
+    question_prompt = get_question_prompt(task_name, doc)
+    choices_prompt, symbol_mapping = get_choices_prompt(permutation, choice_symbol)
+    reversed_symbol_mapping = {v: k for k, v in symbol_mapping.items()}
+    prompt = f'{instruction_prompt}\n\n{question_prompt}\n\n{choices_prompt}\n\n'
+
+    return prompt, reversed_symbol_mapping
 
 
 # choice_symbol: original, reversed
-def experiment_per_doc(**kwargs):
+def get_doc_jobs(**kwargs):
     task_name = kwargs['task_name']
-    model = kwargs['model']
+    # Every prompt is built once and fanned out to all the models of the sweep
+    models = kwargs.get('models') or [kwargs['model']]
     doc_id = kwargs['doc_id']
     doc = kwargs['doc']
     prompt_type = kwargs['prompt_type']
     choice_symbol = kwargs['choice_symbol']
     validation = kwargs.get('validation', False)
     simplify = kwargs.get('simplify', True)
+    permutation_mode = kwargs.get('permutation_mode') or ('simplify' if simplify else 'all')
+    num_sampled_permutations = kwargs.get('num_sampled_permutations', 24)
+    adaptive_tolerance = kwargs.get('adaptive_tolerance', 0.1)
+    adaptive_min_permutations = kwargs.get('adaptive_min_permutations', 4)
     temperature = kwargs.get('temperature', 0)
     candidate_count = kwargs.get('candidate_count', 5)
+    use_cache = kwargs.get('use_cache', True)
+    hedge_quantile = kwargs.get('hedge_quantile')
+    stream = kwargs.get('stream', False)
+    stop_sequences = kwargs.get('stop_sequences')
+    result_store = kwargs.get('result_store') or get_result_store('directory')
 
-    this_result_dir = RESULTS_DIR / f'{model.model_display_name}/{prompt_type}/{task_name}{f"_val" if validation else ""}/{choice_symbol}/{temperature}/{doc_id}'
-    this_result_dir.mkdir(exist_ok=True, parents=True)
+    shards = [
+        get_shard(model.model_display_name, prompt_type, task_name, validation, choice_symbol, temperature)
+        for model in models
+    ]
 
     ground_truth = doc['ground_truth']
-    permutations = list(itertools.permutations(doc['this_choices']))
-
-    for idx, each_permutation in enumerate(permutations):
-        if len(each_permutation) == 2:
-            simplify_lst = [0, 1]
-        elif len(each_permutation) == 3:
-            simplify_lst = [0, 5]
-        elif len(each_permutation) == 4:
-            simplify_lst = [0, 23]
-        elif len(each_permutation) == 5:
-            simplify_lst = [0, 119]
-
-        if simplify and idx not in simplify_lst:
-            continue
+    num_choices = len(doc['this_choices'])
+    permutation_ids = get_permutation_ids(num_choices, permutation_mode, num_sampled_permutations, seed=f'{task_name}/{doc_id}')
+
+    # In adaptive mode each model draws permutations until its answers converge. The answers are read back from the
+    # result store, which holds them once the consumer has run the jobs and resumed this generator
+    stopping_rules = None
+    if permutation_mode == 'adaptive':
+        stopping_rules = {
+            shard: AdaptiveStoppingRule(adaptive_tolerance, adaptive_min_permutations, num_sampled_permutations)
+            for shard in shards
+        }
 
-        this_result_path = this_result_dir / f'{doc_id}_{idx}.json'
-        if this_result_path.exists():
+    # Only the requested permutations are decoded from their rank, never all n! of them
+    for idx in permutation_ids:
+        active = list(zip(models, shards))
+        if stopping_rules is not None:
+            active = [(model, shard) for model, shard in active if not stopping_rules[shard].is_converged()]
+            if not active:
+                break
+            for model, shard in active:
+                stopping_rules[shard].draw()
+                stopping_rules[shard].observe(result_store.get_answer(shard, doc_id, idx))
+
+        pending = [
+            (model, shard)
+            for model, shard in active
+            if not result_store.exists(shard, doc_id, idx)
+        ]
+        if not pending:
             continue
 
-        print(task_name)
-        print(f'doc_id: {doc_id}, permutation_id: {idx} ground_truth: {ground_truth}')
-        print(f'permutation: {each_permutation}\n====================')
-        this_result_idx = each_permutation.index(ground_truth)
-
-        # Generate prompt
-        instruction_prompt = get_instruction_prompt(each_permutation, prompt_type)
-        question_prompt = get_question_prompt(task_name, doc)
-        choices_prompt, symbol_mapping = get_choices_prompt(each_permutation, choice_symbol)
-        reversed_symbol_mapping = {v: k for k, v in symbol_mapping.items()}
-        prompt = f'{instruction_prompt}\n\n{question_prompt}\n\n{choices_prompt}\n\n'
-
-        result = model.generate(
-            temperature=temperature,
-            prompt=prompt,
-            candidate_count=candidate_count,
-            max_output_tokens=1000
+        with METRICS.timer('stage_seconds', stage='prompt_build'):
+            each_permutation = nth_permutation(doc['this_choices'], idx)
+            prompt, reversed_symbol_mapping = build_prompt(task_name, doc, each_permutation, prompt_type, choice_symbol)
+
+        for model, shard in pending:
+            yield {
+                'task_name': task_name,
+                'model': model,
+                'doc_id': doc_id,
+                'permutation_id': idx,
+                'permutation': each_permutation,
+                'permutation_design': permutation_mode,
+                'num_sampled_permutations': num_sampled_permutations,
+                'ground_truth': ground_truth,
+                'prompt': prompt,
+                'symbol_mapping': reversed_symbol_mapping,
+                'prompt_type': prompt_type,
+                'choice_symbol': choice_symbol,
+                'logprob_answer': prompt_type == 'symbol_only',
+                'temperature': temperature,
+                'candidate_count': candidate_count,
+                'use_cache': use_cache,
+                'hedge_quantile': hedge_quantile,
+                'stream': stream,
+                'stop_sequences': stop_sequences,
+                'result_store': result_store,
+                'shard': shard,
+            }
+
+        if stopping_rules is not None:
+            for model, shard in pending:
+                stopping_rules[shard].observe(result_store.get_answer(shard, doc_id, idx))
+
+
+def print_job(job):
+    print(job['task_name'])
+    print(f'doc_id: {job["doc_id"]}, permutation_id: {job["permutation_id"]} ground_truth: {job["ground_truth"]}')
+    print(f'permutation: {job["permutation"]}\n====================')
+
+
+def get_generate_kwargs(job):
+    # A symbol_only answer fits in a few tokens, the verdict of the other prompt types may follow a long explanation
+    logprob_answer = job.get('logprob_answer', False)
+    return {
+        'temperature': job['temperature'],
+        'prompt': job['prompt'],
+        'candidate_count': job['candidate_count'],
+        'max_output_tokens': 3 if logprob_answer else 1000,
+        'logprob_answer': logprob_answer,
+        'use_cache': job['use_cache'],
+        'hedge_quantile': job.get('hedge_quantile'),
+        'stream': job.get('stream', False),
+        'stop_sequences': job.get('stop_sequences'),
+        'choice_symbols': list(job['symbol_mapping']),
+    }
+
+
+def save_job_result(job, result):
+    each_permutation = job['permutation']
+    reversed_symbol_mapping = job['symbol_mapping']
+
+    lowercase = job['choice_symbol'] == 'lowercase'
+    with METRICS.timer('stage_seconds', stage='extraction'):
+        answer_choice, answer_index, answer_text = extract_answer(
+            result, each_permutation, reversed_symbol_mapping, lowercase
         )
-        answer_choice = extract_llm_result(result['result'], choice_symbol == 'lowercase')
-        answer_index = reversed_symbol_mapping.get(answer_choice)
-
-        output_info = {
-            'task': task_name,
-            'doc_id': doc_id,
-            'permutation_id': idx,
-            'prompt': prompt,
-            'permutation': each_permutation,
-            'ground_truth_text': ground_truth,
-            'ground_truth_index': this_result_idx,
-            'answer_choice': answer_choice,
-            'answer_index': answer_index,
-            'answer_text': each_permutation[answer_index] if answer_index is not None else '',
-            'symbol_mapping': reversed_symbol_mapping,
-            'details': result,
-        }
-        this_result_path.write_text(json.dumps(output_info, indent=4))
+        # The first tokens of a free-text answer say nothing about the verdict, only symbol_only answers start with it
+        if job.get('logprob_answer'):
+            symbol_distribution = extract_symbol_distribution(result, list(reversed_symbol_mapping), lowercase)
+        else:
+            symbol_distribution = (result.get('info') or {}).get('symbol_distribution')
+
+    output_info = {
+        'task': job['task_name'],
+        'doc_id': job['doc_id'],
+        'permutation_id': job['permutation_id'],
+        'prompt': job['prompt'],
+        'permutation': each_permutation,
+        'permutation_design': job.get('permutation_design'),
+        'num_sampled_permutations': job.get('num_sampled_permutations'),
+        'ground_truth_text': job['ground_truth'],
+        'ground_truth_index': each_permutation.index(job['ground_truth']),
+        'answer_choice': answer_choice,
+        'answer_index': answer_index,
+        'answer_text': answer_text,
+        'symbol_mapping': reversed_symbol_mapping,
+        'symbol_distribution': symbol_distribution,
+        'details': result,
+    }
+    with METRICS.timer('stage_seconds', stage='result_write'):
+        job['result_store'].write(job['shard'], output_info)
+    METRICS.inc('jobs_completed_total', model=job['model'].model_display_name)
+
+
+def run_job(job):
+    print_job(job)
+    result = job['model'].generate(**get_generate_kwargs(job))
+    save_job_result(job, result)
+
+
+async def run_job_async(job):
+    provider = job['model'].provider
+    print_job(job)
+    METRICS.add('requests_in_flight', 1, provider=provider)
+    try:
+        result = await job['model'].agenerate(**get_generate_kwargs(job))
+    finally:
+        METRICS.add('requests_in_flight', -1, provider=provider)
+    save_job_result(job, result)
+
+
+def get_doc_variant_jobs(**kwargs):
+    # Expand one preprocessed doc into the jobs of every (prompt_type, choice_symbol) variant of the sweep
+    prompt_types = kwargs.get('prompt_types') or [kwargs['prompt_type']]
+    choice_symbols = kwargs.get('choice_symbols') or [kwargs['choice_symbol']]
+
+    for prompt_type in prompt_types:
+        for choice_symbol in choice_symbols:
+            yield from get_doc_jobs(**{**kwargs, 'prompt_type': prompt_type, 'choice_symbol': choice_symbol})
+
+
+def run_doc_jobs_batched(jobs):
+    # All pending permutations and variants of a doc go through the model in one batched call
+    if not jobs:
+        return
+
+    results = jobs[0]['model'].score_batch([get_generate_kwargs(job) for job in jobs])
+    for job, result in zip(jobs, results):
+        print_job(job)
+        save_job_result(job, result)
+
+
+def experiment_per_doc(**kwargs):
+    # Adaptive sampling needs each answer before drawing the next permutation, so nothing is held back for batching
+    batch_jobs = kwargs.get('permutation_mode') != 'adaptive'
+    batched_jobs = dict()
+    for job in get_doc_variant_jobs(**kwargs):
+        if batch_jobs and job['model'].batched_scoring:
+            batched_jobs.setdefault(job['model'].model_display_name, []).append(job)
+        else:
+            run_job(job)
+
+    for jobs in batched_jobs.values():
+        run_doc_jobs_batched(jobs)
+
+
+MODELS = {}
 
 
 def get_model(model_name):
-    if model_name == 'palm2':
-        model = PaLM2Model(model_name='palm2')
-    elif model_name == 'gemini-pro':
-        model = GeminiModel(model_name='gemini-pro')
-    elif model_name == 'Llama-2-7b-chat':
-        model = LlamaModel(model_name='Llama-2-7b-chat')
-    elif model_name == 'Llama-2-13b-chat':
-        model = LlamaModel(model_name='Llama-2-13b-chat')
-    elif model_name == 'Llama-2-70b-chat':
-        model = LlamaModel(model_name='Llama-2-70b-chat')
-    elif model_name == 'gpt-3.5-1106':
-        model = OpenAIModel(model_name='gpt-3.5-1106')
-    else:
-        raise RuntimeError('Model not supported')
+    # Models hold their API clients and connection pools, so reuse them for the whole run
+    if model_name in MODELS:
+        return MODELS[model_name]
+
+    model = create_model(model_name)
 
+    MODELS[model_name] = model
     return model
@@ -0,0 +1,140 @@
+import math
+import random
+from collections import Counter
+
+
+# Permutations are addressed by their rank in itertools.permutations order (lexicographic in the
+# original choice positions), so permutation_id stays comparable with results of earlier runs.
+def nth_permutation(items, rank):
+    pool = list(items)
+    permutation = []
+    for i in range(len(pool), 0, -1):
+        index, rank = divmod(rank, math.factorial(i - 1))
+        permutation.append(pool.pop(index))
+
+    return tuple(permutation)
+
+
+def permutation_rank(permutation):
+    # Inverse of nth_permutation for a permutation of the positions range(len(permutation))
+    pool = sorted(permutation)
+    rank = 0
+    for item in permutation:
+        index = pool.index(item)
+        rank += index * math.factorial(len(pool) - 1)
+        pool.pop(index)
+
+    return rank
+
+
+def get_cyclic_lst(num_choices):
+    # The n rotations of the original order, each choice takes each position once
+    return [
+        permutation_rank([(position + shift) % num_choices for position in range(num_choices)])
+        for shift in range(num_choices)
+    ]
+
+
+def get_latin_square_lst(num_choices):
+    # Williams design: each choice takes each position once and directly follows every other choice equally often.
+    # The first row is 0, 1, n-1, 2, n-2, ..., the others add a shift. An odd n also needs the reversed rows
+    first_row = [0]
+    low, high = 1, num_choices - 1
+    for i in range(1, num_choices):
+        if i % 2:
+            first_row.append(low)
+            low += 1
+        else:
+            first_row.append(high)
+            high -= 1
+
+    rows = [[(choice + shift) % num_choices for choice in first_row] for shift in range(num_choices)]
+    if num_choices % 2:
+        rows += [row[::-1] for row in rows]
+
+    # Relabel the choices so that the first row is the original order, which keeps the square balanced
+    labels = {choice: position for position, choice in enumerate(first_row)}
+    rows = [[labels[choice] for choice in row] for row in rows]
+
+    return list(dict.fromkeys(permutation_rank(row) for row in rows))
+
+
+def get_simplify_lst(num_choices):
+    # The original order and its full reversal, which are the same permutation for a single choice
+    return list(dict.fromkeys([0, math.factorial(num_choices) - 1]))
+
+
+def sample_permutation_ids(num_choices, num_samples, seed=None):
+    num_permutations = math.factorial(num_choices)
+    if num_samples >= num_permutations:
+        return list(range(num_permutations))
+
+    # The identity is always evaluated, the rest are drawn without replacement
+    rng = random.Random(seed)
+    sampled = {0}
+    while len(sampled) < num_samples:
+        sampled.add(rng.randrange(num_permutations))
+
+    return sorted(sampled)
+
+
+def iter_adaptive_permutation_ids(num_choices, seed=None):
+    # The simplify pair first, so adaptive runs share their first results with simplify runs, then a seeded random order
+    num_permutations = math.factorial(num_choices)
+    rest = list(range(1, num_permutations - 1))
+    random.Random(seed).shuffle(rest)
+
+    yield from get_simplify_lst(num_choices) + rest
+
+
+class AdaptiveStoppingRule:
+    """Stop drawing permutations of a doc once its answer distribution over the original choices is estimated closely enough.
+
+    The distribution is considered stable when the standard error of every answer's frequency is at most tolerance, so
+    a doc answered the same way under every order stops after min_permutations, and a position-sensitive one runs on
+    up to max_permutations.
+    """
+
+    def __init__(self, tolerance=0.1, min_permutations=4, max_permutations=24):
+        self.tolerance = tolerance
+        self.min_permutations = min_permutations
+        self.max_permutations = max_permutations
+        self.num_drawn = 0
+        self.answer_counts = Counter()
+
+    def draw(self):
+        self.num_drawn += 1
+
+    def observe(self, answer_text):
+        # Answers that are not known (e.g. when planning) count as drawn but say nothing about convergence
+        if answer_text is not None:
+            self.answer_counts[answer_text] += 1
+
+    def is_converged(self):
+        if self.num_drawn >= self.max_permutations:
+            return True
+        num_answers = sum(self.answer_counts.values())
+        if num_answers < self.min_permutations:
+            return False
+
+        return max(
+            math.sqrt(count / num_answers * (1 - count / num_answers) / num_answers)
+            for count in self.answer_counts.values()
+        ) <= self.tolerance
+
+
+def get_permutation_ids(num_choices, permutation_mode, num_sampled_permutations=None, seed=None):
+    if permutation_mode == 'simplify':
+        return get_simplify_lst(num_choices)
+    elif permutation_mode == 'all':
+        return range(math.factorial(num_choices))
+    elif permutation_mode == 'sampled':
+        return sample_permutation_ids(num_choices, num_sampled_permutations, seed)
+    elif permutation_mode == 'adaptive':
+        return iter_adaptive_permutation_ids(num_choices, seed)
+    elif permutation_mode == 'cyclic':
+        return get_cyclic_lst(num_choices)
+    elif permutation_mode == 'latin_square':
+        return get_latin_square_lst(num_choices)
+    else:
+        raise ValueError(f'Unknown permutation mode: {permutation_mode}')
@@ -0,0 +1,111 @@
+from collections import defaultdict
+
+from llm_tool.config import MODEL_PRICING, RATE_LIMITS, MAX_CONCURRENCY, GOOGLE_API_KEYS, OPENAI_API_KEY
+from llm_tool.key_pool import estimate_tokens
+from llm_tool.cache import get_response_cache
+from utils.experiment import get_generate_kwargs
+from utils.runner import iter_jobs
+
+TOKENIZER = None
+TOKENIZER_LOADED = False
+
+
+def get_tokenizer():
+    # tiktoken is optional and may have to download its encoding, any failure falls back to estimate_tokens
+    global TOKENIZER, TOKENIZER_LOADED
+    if not TOKENIZER_LOADED:
+        TOKENIZER_LOADED = True
+        try:
+            import tiktoken
+            TOKENIZER = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            print(f'tiktoken is not available ({type(e).__name__}), token counts are estimated')
+
+    return TOKENIZER
+
+
+def count_tokens(prompt):
+    tokenizer = get_tokenizer()
+    if tokenizer is not None:
+        return len(tokenizer.encode(prompt))
+
+    return estimate_tokens(prompt)
+
+
+def get_num_keys(provider):
+    if provider == 'openai':
+        return len([api_key for api_key in OPENAI_API_KEY if api_key])
+    elif provider == 'google':
+        return len([api_key for api_key in GOOGLE_API_KEYS if api_key])
+    else:
+        # One serverless endpoint and key per Azure model
+        return 1
+
+
+def get_min_minutes(provider, num_calls, num_tokens):
+    # Lower bound from the per-key rate limits, assuming every configured key is fully used
+    num_keys = max(get_num_keys(provider), 1)
+    rate_limits = RATE_LIMITS.get(provider, {})
+    minutes = num_calls / (rate_limits['rpm'] * num_keys) if rate_limits.get('rpm') else 0
+    if rate_limits.get('tpm'):
+        minutes = max(minutes, num_tokens / (rate_limits['tpm'] * num_keys))
+
+    return minutes
+
+
+def is_cached(job):
+    generate_kwargs = get_generate_kwargs(job)
+    if not generate_kwargs['use_cache'] or generate_kwargs['temperature'] != 0:
+        return False
+
+    cache = get_response_cache()
+    return cache.contains(cache.make_key(
+        job['model'].model_name,
+        generate_kwargs['prompt'],
+        generate_kwargs['temperature'],
+        generate_kwargs['candidate_count'],
+        generate_kwargs['max_output_tokens'],
+        generate_kwargs['stop_sequences'],
+        job['model'].should_stream(**generate_kwargs),
+    ))
+
+
+def plan_experiments(tasks, experiment_config, expected_output_tokens=200):
+    plan = defaultdict(lambda: {'calls': 0, 'prompt_tokens': 0, 'output_tokens': 0})
+    providers = dict()
+    num_cached = 0
+    for job in iter_jobs(tasks, experiment_config):
+        # Jobs answered by the response cache cost neither calls nor tokens
+        if is_cached(job):
+            num_cached += 1
+            continue
+
+        model_name = job['model'].model_display_name
+        providers[model_name] = job['model'].provider
+        row = plan[(model_name, job['task_name'])]
+        row['calls'] += 1
+        row['prompt_tokens'] += count_tokens(job['prompt'])
+        row['output_tokens'] += min(expected_output_tokens, get_generate_kwargs(job)['max_output_tokens'])
+
+    print(f'\nPending jobs already in the response cache: {num_cached}')
+
+    print(f'\n{"model":<20}{"task":<50}{"calls":>10}{"prompt tokens":>16}{"output tokens":>16}{"cost (USD)":>12}')
+    totals = defaultdict(lambda: {'calls': 0, 'prompt_tokens': 0, 'output_tokens': 0, 'cost': 0})
+    for (model_name, task_name), row in sorted(plan.items()):
+        output_tokens = row['output_tokens']
+        pricing = MODEL_PRICING.get(model_name, {'input': 0, 'output': 0})
+        cost = (row['prompt_tokens'] * pricing['input'] + output_tokens * pricing['output']) / 1e6
+        print(f'{model_name:<20}{task_name:<50}{row["calls"]:>10}{row["prompt_tokens"]:>16}{output_tokens:>16}{cost:>12.2f}')
+
+        total = totals[model_name]
+        total['calls'] += row['calls']
+        total['prompt_tokens'] += row['prompt_tokens']
+        total['output_tokens'] += output_tokens
+        total['cost'] += cost
+
+    print(f'\n{"model":<20}{"calls":>10}{"prompt tokens":>16}{"output tokens":>16}{"cost (USD)":>12}{"keys":>6}{"concurrency":>13}{"min minutes":>13}')
+    for model_name, total in sorted(totals.items()):
+        provider = providers[model_name]
+        minutes = get_min_minutes(provider, total['calls'], total['prompt_tokens'] + total['output_tokens'])
+        print(f'{model_name:<20}{total["calls"]:>10}{total["prompt_tokens"]:>16}{total["output_tokens"]:>16}{total["cost"]:>12.2f}'
+              f'{get_num_keys(provider):>6}{MAX_CONCURRENCY.get(provider, 1):>13}{minutes:>13.1f}')
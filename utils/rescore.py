@@ -0,0 +1,57 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from utils.data import extract_answer
+from utils.storage import get_result_store
+
+
+def rescore_record(record, lowercase=False):
+    answer_choice, answer_index, answer_text = extract_answer(
+        record['details'], record['permutation'], record['symbol_mapping'], lowercase
+    )
+    if (answer_choice, answer_index, answer_text) == (record['answer_choice'], record['answer_index'], record['answer_text']):
+        return None
+
+    return {
+        **record,
+        'answer_choice': answer_choice,
+        'answer_index': answer_index,
+        'answer_text': answer_text,
+    }
+
+
+def rescore_shard(result_store_name, shard, dry_run=False):
+    result_store = get_result_store(result_store_name)
+    lowercase = shard[3] == 'lowercase'
+
+    num_records = 0
+    changed = []
+    for record in result_store.iter_records(shard):
+        num_records += 1
+        rescored = rescore_record(record, lowercase)
+        if rescored is not None:
+            changed.append(rescored)
+
+    if changed and not dry_run:
+        result_store.update_records(shard, changed)
+
+    return num_records, len(changed)
+
+
+def rescore_results(result_store_names=('directory', 'jsonl'), num_workers=None, dry_run=False):
+    # Shards are independent, so each one is re-scored by a separate worker process
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = {
+            executor.submit(rescore_shard, result_store_name, shard, dry_run): shard
+            for result_store_name in result_store_names
+            for shard in get_result_store(result_store_name).iter_shards()
+        }
+
+        total_records = total_changed = 0
+        for future in as_completed(futures):
+            num_records, num_changed = future.result()
+            total_records += num_records
+            total_changed += num_changed
+            if num_changed:
+                print(f'{"/".join(futures[future])}: {num_changed}/{num_records} records changed')
+
+    print(f'Re-scored {total_records} records, {total_changed} changed{" (dry run, nothing written)" if dry_run else ""}')
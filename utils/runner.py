@@ -0,0 +1,205 @@
+import asyncio
+import itertools
+import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from llm_tool.config import MAX_CONCURRENCY, MAX_PROVIDER_BACKLOG, BATCH_MAX_REQUESTS
+from llm_tool.concurrency import set_concurrency_limits
+from llm_tool.metrics import METRICS
+from utils.common import BATCH_DIR
+from utils.experiment import get_doc_variant_jobs, run_job_async, get_model, get_generate_kwargs, save_job_result
+
+
+def iter_doc_kwargs(tasks, experiment_config):
+    for task in tasks:
+        models = [get_model(model_name) for model_name in task['args'].model]
+        for doc_id, doc in enumerate(itertools.islice(task["task_docs"], 0, None)):
+            yield {
+                'task_name': task["task"],
+                'models': models,
+                'doc_id': doc_id,
+                'doc': doc,
+                **experiment_config
+            }
+
+
+def iter_jobs(tasks, experiment_config):
+    for doc_kwargs in iter_doc_kwargs(tasks, experiment_config):
+        yield from get_doc_variant_jobs(**doc_kwargs)
+
+
+async def run_provider_worker(provider, queue, taken):
+    # Items are sequences of jobs, run in order: a single job, or the lazily drawn permutations of an adaptive doc
+    while True:
+        jobs = await queue.get()
+        taken.set()
+        if jobs is None:
+            return
+        for job in jobs:
+            await run_job_async(job)
+        METRICS.set('queue_depth', queue.qsize(), provider=provider)
+
+
+async def run_experiments_async(tasks, experiment_config, concurrency=None):
+    limits = dict(MAX_CONCURRENCY)
+    if concurrency is not None:
+        limits = {provider: concurrency for provider in limits}
+    set_concurrency_limits(limits)
+
+    # to_thread shares the default executor, which must be large enough for every provider at once
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=sum(limits.values())))
+
+    # Each provider has its own backlog and as many workers as its concurrency limit. The producer waits when the backlog
+    # of every provider in the sweep is at capacity, so the docs are not materialized up front while all are busy. A
+    # slow provider's backlog may grow past its capacity while a faster one keeps running, up to MAX_PROVIDER_BACKLOG,
+    # which bounds the memory held by queued jobs
+    capacities = {provider: 2 * limit for provider, limit in limits.items()}
+    queues = {provider: asyncio.Queue() for provider in limits}
+    sweep_providers = set()
+    taken = asyncio.Event()
+    workers = [
+        asyncio.create_task(run_provider_worker(provider, queues[provider], taken))
+        for provider, limit in limits.items()
+        for _ in range(limit)
+    ]
+
+    async def put(provider, jobs):
+        sweep_providers.add(provider)
+        queues[provider].put_nowait(jobs)
+        METRICS.set('queue_depth', queues[provider].qsize(), provider=provider)
+        while (
+            all(queues[provider].qsize() >= capacities[provider] for provider in sweep_providers)
+            or any(queues[provider].qsize() >= MAX_PROVIDER_BACKLOG for provider in sweep_providers)
+        ):
+            taken.clear()
+            await taken.wait()
+
+    async def produce():
+        if experiment_config.get('permutation_mode') == 'adaptive':
+            # Each answer decides whether the next permutation is drawn, so every (doc, model) is one sequence of jobs
+            # that a worker of the model's provider runs to the end, independently of the other models
+            for doc_kwargs in iter_doc_kwargs(tasks, experiment_config):
+                for model in doc_kwargs['models']:
+                    await put(model.provider, get_doc_variant_jobs(**{**doc_kwargs, 'models': [model]}))
+        else:
+            for job in iter_jobs(tasks, experiment_config):
+                await put(job['model'].provider, [job])
+
+        for provider, limit in limits.items():
+            for _ in range(limit):
+                queues[provider].put_nowait(None)
+
+    # The first failure propagates, asyncio.run then cancels the remaining workers
+    await asyncio.gather(produce(), *workers)
+
+
+def run_experiments(tasks, experiment_config, concurrency=None):
+    asyncio.run(run_experiments_async(tasks, experiment_config, concurrency))
+
+
+def serialize_job(job):
+    job = {
+        key: value
+        for key, value in job.items()
+        if key != 'result_store'
+    }
+    job['model'] = job['model'].model_display_name
+
+    return job
+
+
+def write_batch_files(jobs, batch_dir=BATCH_DIR, max_requests=BATCH_MAX_REQUESTS):
+    # Each batch input file has a sidecar with the job metadata needed to turn responses into result records
+    batch_dir.mkdir(exist_ok=True, parents=True)
+    prefix = datetime.now().strftime('%Y%m%d_%H%M%S')
+    jobs = iter(jobs)
+
+    input_paths = []
+    for chunk_id in itertools.count():
+        chunk = list(itertools.islice(jobs, max_requests))
+        if not chunk:
+            break
+
+        # Checked before anything is written, so that a mixed sweep does not leave a partial input file behind
+        for job in chunk:
+            if job['model'].provider != 'openai':
+                raise ValueError(f'Batch mode is only supported for OpenAI models, got {job["model"].model_display_name}')
+
+        input_path = batch_dir / f'{prefix}_{chunk_id}.jsonl'
+        with input_path.open('w') as input_file, input_path.with_suffix('.jobs.jsonl').open('w') as jobs_file:
+            for request_id, job in enumerate(chunk):
+                custom_id = f'request-{request_id}'
+                request = job['model'].build_batch_request(custom_id, **get_generate_kwargs(job))
+                input_file.write(json.dumps(request) + '\n')
+                jobs_file.write(json.dumps({'custom_id': custom_id, **serialize_job(job)}) + '\n')
+        input_paths.append(input_path)
+        print(f'Wrote {len(chunk)} requests to {input_path}')
+
+    return input_paths
+
+
+def submit_batch(input_path, transport):
+    with input_path.open() as f:
+        endpoint = json.loads(f.readline())['url']
+    state = {
+        'batch_id': transport.submit(input_path, endpoint),
+        'collected': False,
+    }
+    state_path = input_path.with_suffix('.batch.json')
+    state_path.write_text(json.dumps(state, indent=4))
+    print(f'Submitted {input_path} as batch {state["batch_id"]}')
+
+    return state_path
+
+
+def collect_batch(state_path, transport, result_store):
+    state = json.loads(state_path.read_text())
+    if state['collected']:
+        return
+
+    output = transport.wait(state['batch_id'])
+
+    jobs = dict()
+    with state_path.with_suffix('').with_suffix('.jobs.jsonl').open() as f:
+        for line in f:
+            job = json.loads(line)
+            jobs[job.pop('custom_id')] = job
+
+    num_saved = 0
+    for line in output.splitlines():
+        if not line.strip():
+            continue
+        response = json.loads(line)
+        if response.get('error') or response['response']['status_code'] != 200:
+            print(f'Batch request {response["custom_id"]} failed: {response.get("error") or response["response"]["body"]}')
+            continue
+
+        job = jobs[response['custom_id']]
+        job['model'] = get_model(job['model'])
+        job['shard'] = tuple(job['shard'])
+        job['result_store'] = result_store
+        result = job['model'].process_batch_response(response, transport.api_key)
+        save_job_result(job, result)
+        num_saved += 1
+
+    result_store.flush()
+    state['collected'] = True
+    state_path.write_text(json.dumps(state, indent=4))
+    print(f'Collected {num_saved}/{len(jobs)} results from batch {state["batch_id"]}')
+
+
+def run_experiments_batch(tasks, experiment_config, transport, batch_dir=BATCH_DIR):
+    if experiment_config.get('permutation_mode') == 'adaptive':
+        raise ValueError('Batch mode submits every job up front, it cannot be used with --permutation_mode adaptive')
+    result_store = experiment_config['result_store']
+
+    # Batches submitted by an interrupted run are collected first, so their jobs are not submitted again
+    for state_path in sorted(batch_dir.glob('*.batch.json')):
+        collect_batch(state_path, transport, result_store)
+
+    input_paths = write_batch_files(iter_jobs(tasks, experiment_config), batch_dir)
+    state_paths = [submit_batch(input_path, transport) for input_path in input_paths]
+    for state_path in state_paths:
+        collect_batch(state_path, transport, result_store)
@@ -0,0 +1,229 @@
+import json
+import os
+import threading
+
+from utils.common import RESULTS_DIR
+
+
+def get_shard(model_display_name, prompt_type, task_name, validation, choice_symbol, temperature):
+    return (model_display_name, prompt_type, f'{task_name}{f"_val" if validation else ""}', choice_symbol, str(temperature))
+
+
+class ResultStore:
+    # Completed (doc_id, permutation_id) pairs are indexed once per shard, so resuming never touches the filesystem per permutation.
+    # The index maps them to their answer_text, or to None when it has to be read back from the record
+    def __init__(self):
+        self.completed = dict()
+        self.lock = threading.Lock()
+
+    def load_completed(self, shard):
+        raise NotImplementedError
+
+    def get_completed(self, shard):
+        if shard not in self.completed:
+            self.completed[shard] = self.load_completed(shard)
+            print(f'Resume index: {len(self.completed[shard])} completed permutations in {"/".join(shard)}')
+
+        return self.completed[shard]
+
+    def exists(self, shard, doc_id, permutation_id):
+        with self.lock:
+            return (doc_id, permutation_id) in self.get_completed(shard)
+
+    def get_answer(self, shard, doc_id, permutation_id):
+        # answer_text of a completed permutation, None if it has not been run
+        with self.lock:
+            completed = self.get_completed(shard)
+            if (doc_id, permutation_id) not in completed:
+                return None
+            answer_text = completed[(doc_id, permutation_id)]
+
+        if answer_text is None:
+            answer_text = self.read_record(shard, doc_id, permutation_id)['answer_text']
+            with self.lock:
+                completed[(doc_id, permutation_id)] = answer_text
+
+        return answer_text
+
+    def read_record(self, shard, doc_id, permutation_id):
+        raise NotImplementedError
+
+    def write(self, shard, record):
+        raise NotImplementedError
+
+    def iter_shards(self):
+        raise NotImplementedError
+
+    def iter_records(self, shard):
+        raise NotImplementedError
+
+    def update_records(self, shard, records):
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+
+class DirectoryResultStore(ResultStore):
+    # One indented JSON file per permutation: results/<model>/<prompt_type>/<task>/<symbol>/<temp>/<doc_id>/<doc_id>_<permutation_id>.json
+    def __init__(self, root=RESULTS_DIR):
+        super().__init__()
+        self.root = root
+        self.created_dirs = set()
+
+    def get_result_dir(self, shard, doc_id):
+        return self.root.joinpath(*shard, str(doc_id))
+
+    def get_result_path(self, shard, doc_id, permutation_id):
+        return self.get_result_dir(shard, doc_id) / f'{doc_id}_{permutation_id}.json'
+
+    def load_completed(self, shard):
+        # One bulk scan of the shard instead of an exists() call per permutation, answers are only read when asked for
+        completed = dict()
+        shard_dir = self.root.joinpath(*shard)
+        if not shard_dir.is_dir():
+            return completed
+
+        for doc_entry in os.scandir(shard_dir):
+            if not doc_entry.is_dir():
+                continue
+            for entry in os.scandir(doc_entry.path):
+                doc_id, _, permutation_id = entry.name.removesuffix('.json').partition('_')
+                if entry.name.endswith('.json') and doc_id.isdigit() and permutation_id.isdigit():
+                    completed[(int(doc_id), int(permutation_id))] = None
+
+        return completed
+
+    def write(self, shard, record):
+        result_dir = self.get_result_dir(shard, record['doc_id'])
+        if result_dir not in self.created_dirs:
+            result_dir.mkdir(exist_ok=True, parents=True)
+            self.created_dirs.add(result_dir)
+
+        self.get_result_path(shard, record['doc_id'], record['permutation_id']).write_text(json.dumps(record, indent=4))
+        with self.lock:
+            self.get_completed(shard)[(record['doc_id'], record['permutation_id'])] = record['answer_text']
+
+    def read_record(self, shard, doc_id, permutation_id):
+        return json.loads(self.get_result_path(shard, doc_id, permutation_id).read_text())
+
+    def iter_shards(self):
+        for shard_dir in sorted(self.root.glob('*/*/*/*/*')):
+            if shard_dir.is_dir():
+                yield shard_dir.relative_to(self.root).parts
+
+    def iter_records(self, shard):
+        for doc_entry in os.scandir(self.root.joinpath(*shard)):
+            if not doc_entry.is_dir():
+                continue
+            for entry in os.scandir(doc_entry.path):
+                if entry.name.endswith('.json'):
+                    with open(entry.path) as f:
+                        yield json.load(f)
+
+    def update_records(self, shard, records):
+        for record in records:
+            self.get_result_path(shard, record['doc_id'], record['permutation_id']).write_text(json.dumps(record, indent=4))
+
+
+class JsonlResultStore(ResultStore):
+    # One append-only JSONL file per shard: results/<model>/<prompt_type>/<task>/<symbol>/<temp>.jsonl
+    def __init__(self, root=RESULTS_DIR, checkpoint_every=100):
+        super().__init__()
+        self.root = root
+        self.checkpoint_every = checkpoint_every
+        self.buffers = dict()
+        self.num_buffered = 0
+
+    def get_shard_path(self, shard):
+        return self.root.joinpath(*shard[:-1], f'{shard[-1]}.jsonl')
+
+    def load_completed(self, shard):
+        if not self.get_shard_path(shard).exists():
+            return dict()
+
+        return {
+            (record['doc_id'], record['permutation_id']): record['answer_text']
+            for record in self.iter_records(shard)
+        }
+
+    def iter_shards(self):
+        for shard_path in sorted(self.root.glob('*/*/*/*/*.jsonl')):
+            yield shard_path.relative_to(self.root).with_suffix('').parts
+
+    def iter_records(self, shard):
+        with self.get_shard_path(shard).open() as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A torn final line from an interrupted run, the permutation is simply redone
+                    continue
+                yield record
+
+    def update_records(self, shard, records):
+        # Rewrite the shard into a temporary file and swap it in, so an interruption never loses records
+        self.flush()
+        updates = {
+            (record['doc_id'], record['permutation_id']): record
+            for record in records
+        }
+        shard_path = self.get_shard_path(shard)
+        tmp_path = shard_path.with_suffix('.jsonl.tmp')
+        with tmp_path.open('w') as f:
+            for record in self.iter_records(shard):
+                record = updates.get((record['doc_id'], record['permutation_id']), record)
+                f.write(json.dumps(record) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, shard_path)
+
+    def write(self, shard, record):
+        with self.lock:
+            self.buffers.setdefault(shard, []).append(json.dumps(record))
+            self.get_completed(shard)[(record['doc_id'], record['permutation_id'])] = record['answer_text']
+            self.num_buffered += 1
+            if self.num_buffered >= self.checkpoint_every:
+                self.checkpoint()
+
+    def checkpoint(self):
+        for shard, lines in self.buffers.items():
+            shard_path = self.get_shard_path(shard)
+            shard_path.parent.mkdir(exist_ok=True, parents=True)
+            with shard_path.open('ab+') as f:
+                # Terminate a torn line left by an interrupted run so the new records stay parseable
+                if f.tell() > 0:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b'\n':
+                        f.write(b'\n')
+                f.write(('\n'.join(lines) + '\n').encode('utf-8'))
+                f.flush()
+                os.fsync(f.fileno())
+        self.buffers = dict()
+        self.num_buffered = 0
+
+    def flush(self):
+        with self.lock:
+            self.checkpoint()
+
+
+RESULT_STORES = dict()
+
+
+def get_result_store(name):
+    # Shared per backend so the resume index is built once per run
+    if name in RESULT_STORES:
+        return RESULT_STORES[name]
+
+    if name == 'directory':
+        result_store = DirectoryResultStore()
+    elif name == 'jsonl':
+        result_store = JsonlResultStore()
+    else:
+        raise ValueError(f'Unknown result store: {name}')
+
+    RESULT_STORES[name] = result_store
+    return result_store